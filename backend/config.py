@@ -29,3 +29,31 @@ TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
 
 # Environment
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
+
+# Catalog cache
+# 轮询 Redis 中目录版本号的间隔（秒）：订阅断开时的退化路径，订阅期间也按这个间隔核对一次
+CATALOG_POLL_INTERVAL_SECONDS = float(os.getenv("CATALOG_POLL_INTERVAL_SECONDS", "2"))
+# 目录类接口的 Cache-Control：允许客户端/代理缓存的秒数，以及过期后可先用旧数据再后台校验的秒数
+CATALOG_CACHE_MAX_AGE_SECONDS = int(os.getenv("CATALOG_CACHE_MAX_AGE_SECONDS", "5"))
+CATALOG_CACHE_STALE_SECONDS = int(os.getenv("CATALOG_CACHE_STALE_SECONDS", "30"))
+
+# Cart
+# 同一类型最多只能选一个的 modifier 类型（逗号分隔），例如一杯饮料只能有一个尺寸、一个甜度
+CART_SINGLE_CHOICE_MODIFIER_TYPES = frozenset(
+    t.strip() for t in os.getenv("CART_SINGLE_CHOICE_MODIFIER_TYPES", "size,sugar,ice").split(",") if t.strip()
+)
+# 购物车存储：redis（默认）/ memory（进程内，测试和压测用）/ sql（carts 系列表）
+CART_STORE_BACKEND = os.getenv("CART_STORE_BACKEND", "redis")
+# store 为 redis 时：Redis 不可用则把购物车操作切换到 SQL 表，恢复后搬回 Redis
+CART_SQL_FALLBACK = os.getenv("CART_SQL_FALLBACK", "true").lower() in ("1", "true", "yes")
+# 切换到 SQL 之后，探测 Redis 是否恢复的间隔（秒）
+CART_REDIS_RETRY_SECONDS = float(os.getenv("CART_REDIS_RETRY_SECONDS", "5"))
+# 把近期写过的购物车批量写回 MySQL 的间隔（秒），Redis 丢数据重启后据此恢复；0 表示不开启
+CART_WRITE_BEHIND_SECONDS = float(os.getenv("CART_WRITE_BEHIND_SECONDS", "0"))
+
+# Idempotency
+# 结算等接口的 Idempotency-Key：保存响应的秒数、执行中占位的秒数、重试等待执行中请求的最长秒数
+# 等待时占用一个线程池线程，所以只等正常结算所需的时间，超时返回 409 让客户端稍后再试
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "30"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "2"))
@@ -1,13 +1,30 @@
 # backend/crud/admin_catalog_crud.py
-from typing import List, Optional
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
 from sqlalchemy.orm import Session
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, tuple_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from backend.models.catalog import (
     Product, ProductType, Modifier, ModifierProduct
 )
+from backend.models.order import ProductAllergen
 from backend.schemas.catalog_schemas import (
-    ProductCreate, ProductUpdate, ModifierCreate, ModifierUpdate, ProductTypeCreate
+    ProductCreate, ProductUpdate, ModifierCreate, ModifierUpdate, ProductTypeCreate,
+    CatalogBundle, CatalogImportResult
 )
+from backend.utils.catalog_bundle import csv_header, csv_rows
+from backend.utils.catalog_cache import catalog_cache, ProductRow
+from backend.utils.search_index import product_search_index
+
+# 说明：这里的每个写操作在 commit 之后都会调用 catalog_cache.invalidate(db)，
+# bump 目录版本号并立即重建进程内快照；产品的增删改同时增量更新搜索索引
+
+
+def _sync_search_index(obj: Product, version: int) -> None:
+    product_search_index.upsert(
+        ProductRow(id=obj.id, name=obj.name, price=obj.price, type_id=obj.type_id, created_at=obj.created_at),
+        version,
+    )
 
 # -------- ProductType --------
 def create_category(db: Session, payload: ProductTypeCreate) -> ProductType:
@@ -15,6 +32,7 @@ def create_category(db: Session, payload: ProductTypeCreate) -> ProductType:
     db.add(obj)
     db.commit()
     db.refresh(obj)
+    catalog_cache.invalidate(db)
     return obj
 
 def delete_category(db: Session, type_id: int) -> int:
@@ -24,6 +42,7 @@ def delete_category(db: Session, type_id: int) -> int:
         return 0
     q.delete()
     db.commit()
+    catalog_cache.invalidate(db)
     return 1
 
 # -------- Product --------
@@ -36,6 +55,8 @@ def create_product(db: Session, payload: ProductCreate) -> Product:
     db.add(obj)
     db.commit()
     db.refresh(obj)
+    version = catalog_cache.invalidate(db)
+    _sync_search_index(obj, version)
     return obj
 
 def update_product(db: Session, product_id: int, payload: ProductUpdate) -> Optional[Product]:
@@ -50,6 +71,8 @@ def update_product(db: Session, product_id: int, payload: ProductUpdate) -> Opti
         obj.type_id = payload.type_id
     db.commit()
     db.refresh(obj)
+    version = catalog_cache.invalidate(db)
+    _sync_search_index(obj, version)
     return obj
 
 def delete_product(db: Session, product_id: int) -> int:
@@ -60,6 +83,8 @@ def delete_product(db: Session, product_id: int) -> int:
     db.query(ModifierProduct).filter(ModifierProduct.product_id == product_id).delete()
     q.delete()
     db.commit()
+    version = catalog_cache.invalidate(db)
+    product_search_index.remove(product_id, version)
     return 1
 
 # -------- Modifier --------
@@ -73,6 +98,7 @@ def create_modifier(db: Session, payload: ModifierCreate) -> Modifier:
     db.add(obj)
     db.commit()
     db.refresh(obj)
+    catalog_cache.invalidate(db)
     return obj
 
 def update_modifier(db: Session, modifier_id: int, payload: ModifierUpdate) -> Optional[Modifier]:
@@ -89,6 +115,7 @@ def update_modifier(db: Session, modifier_id: int, payload: ModifierUpdate) -> O
         obj.is_active = payload.is_active
     db.commit()
     db.refresh(obj)
+    catalog_cache.invalidate(db)
     return obj
 
 def delete_modifier(db: Session, modifier_id: int) -> int:
@@ -99,6 +126,7 @@ def delete_modifier(db: Session, modifier_id: int) -> int:
     db.query(ModifierProduct).filter(ModifierProduct.modifier_id == modifier_id).delete()
     q.delete()
     db.commit()
+    catalog_cache.invalidate(db)
     return 1
 
 # -------- Relations: product <-> modifier --------
@@ -111,6 +139,7 @@ def attach_modifier(db: Session, product_id: int, modifier_id: int) -> bool:
         return False
     db.add(ModifierProduct(product_id=product_id, modifier_id=modifier_id))
     db.commit()
+    catalog_cache.invalidate(db)
     return True
 
 def detach_modifier(db: Session, product_id: int, modifier_id: int) -> int:
@@ -120,4 +149,203 @@ def detach_modifier(db: Session, product_id: int, modifier_id: int) -> int:
     )
     count = q.delete()
     db.commit()
+    if count:
+        catalog_cache.invalidate(db)
     return count
+
+# -------- Batched write helpers --------
+# 每条 INSERT 最多携带的行数（多行 VALUES）
+WRITE_BATCH_SIZE = 500
+
+
+def _chunks(rows: List[dict], size: int = WRITE_BATCH_SIZE):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def _upsert_rows(db: Session, model, rows: List[dict], update_columns: List[str]) -> None:
+    """
+    多行 INSERT ... ON DUPLICATE KEY UPDATE（update_columns 为空时用 INSERT IGNORE），
+    每 WRITE_BATCH_SIZE 行一条语句
+    """
+    for chunk in _chunks(rows):
+        stmt = mysql_insert(model).values(chunk)
+        if update_columns:
+            stmt = stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in update_columns})
+        else:
+            stmt = stmt.prefix_with("IGNORE")
+        db.execute(stmt)
+
+
+def _existing_ids(db: Session, column, ids: Set[int]) -> Set[int]:
+    if not ids:
+        return set()
+    return set(db.execute(select(column).where(column.in_(ids))).scalars().all())
+
+
+# -------- Set-based relation sync --------
+def sync_product_modifiers(db: Session, modifier_sets: Dict[int, Iterable[int]]) -> Dict[str, int]:
+    """
+    声明式同步 product <-> modifier 关联：modifier_sets 为 {product_id: 完整的 modifier_id 集合}
+    - 一次查询读出这些产品现有的关联，在 Python 中算出差集
+    - 每批一条多行 INSERT IGNORE + 一条 DELETE ... WHERE (product_id, modifier_id) IN (...)
+    - 整体一个事务，有变化时只 bump 一次目录版本
+    """
+    desired = {pid: set(mids) for pid, mids in modifier_sets.items()}
+    if not desired:
+        return {"attached": 0, "detached": 0}
+
+    product_ids = set(desired)
+    missing_products = product_ids - _existing_ids(db, Product.id, product_ids)
+    if missing_products:
+        raise ValueError(f"Products not found: {sorted(missing_products)}")
+    modifier_ids = set().union(*desired.values())
+    missing_modifiers = modifier_ids - _existing_ids(db, Modifier.id, modifier_ids)
+    if missing_modifiers:
+        raise ValueError(f"Modifiers not found: {sorted(missing_modifiers)}")
+
+    existing = set(db.execute(
+        select(ModifierProduct.product_id, ModifierProduct.modifier_id)
+        .where(ModifierProduct.product_id.in_(product_ids))
+    ).tuples().all())
+
+    to_add = sorted(
+        (pid, mid) for pid, mids in desired.items() for mid in mids
+        if (pid, mid) not in existing
+    )
+    to_remove = sorted((pid, mid) for pid, mid in existing if mid not in desired[pid])
+
+    try:
+        _upsert_rows(db, ModifierProduct, [
+            {"product_id": pid, "modifier_id": mid} for pid, mid in to_add
+        ], [])
+        for chunk in _chunks(to_remove):
+            db.execute(delete(ModifierProduct).where(
+                tuple_(ModifierProduct.product_id, ModifierProduct.modifier_id).in_(chunk)
+            ))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    if to_add or to_remove:
+        catalog_cache.invalidate(db)
+    return {"attached": len(to_add), "detached": len(to_remove)}
+
+
+# -------- Bulk import / export --------
+def validate_catalog_bundle(db: Session, bundle: CatalogBundle) -> List[str]:
+    """
+    写入前统一校验，返回错误列表（为空表示可以导入）：
+    - 同一类实体 id 不能重复
+    - 产品的 type_id、关联和过敏原引用的产品 / modifier 必须在本次导入或数据库中存在
+    """
+    errors: List[str] = []
+
+    def check_unique(name: str, keys: List[Any]) -> None:
+        seen, dup = set(), set()
+        for key in keys:
+            (dup if key in seen else seen).add(key)
+        if dup:
+            errors.append(f"duplicate {name}: {sorted(dup)[:20]}")
+
+    check_unique("category ids", [c.id for c in bundle.categories])
+    check_unique("product ids", [p.id for p in bundle.products])
+    check_unique("modifier ids", [m.id for m in bundle.modifiers])
+
+    def check_refs(name: str, refs: Set[int], in_bundle: Set[int], column) -> None:
+        missing = refs - in_bundle
+        missing -= _existing_ids(db, column, missing)
+        if missing:
+            errors.append(f"unknown {name}: {sorted(missing)[:20]}")
+
+    check_refs(
+        "category ids referenced by products",
+        {p.type_id for p in bundle.products},
+        {c.id for c in bundle.categories},
+        ProductType.id,
+    )
+    check_refs(
+        "product ids referenced by links/allergens",
+        {link.product_id for link in bundle.links} | {a.product_id for a in bundle.allergens},
+        {p.id for p in bundle.products},
+        Product.id,
+    )
+    check_refs(
+        "modifier ids referenced by links",
+        {link.modifier_id for link in bundle.links},
+        {m.id for m in bundle.modifiers},
+        Modifier.id,
+    )
+    return errors
+
+
+def import_catalog(db: Session, bundle: CatalogBundle) -> CatalogImportResult:
+    """
+    批量导入目录：先整体校验，再在一个事务里用多行 UPSERT 写入，
+    最后只 bump 一次目录版本（缓存只失效一次）
+    """
+    errors = validate_catalog_bundle(db, bundle)
+    if errors:
+        raise ValueError("; ".join(errors))
+
+    try:
+        _upsert_rows(db, ProductType, [c.model_dump() for c in bundle.categories], ["name"])
+        _upsert_rows(db, Product, [p.model_dump() for p in bundle.products], ["name", "price", "type_id"])
+        _upsert_rows(db, Modifier, [m.model_dump() for m in bundle.modifiers], ["name", "type", "price", "is_active"])
+        # 关联和过敏原是纯主键表：已存在就跳过
+        _upsert_rows(db, ModifierProduct, [link.model_dump() for link in bundle.links], [])
+        allergens = {(a.product_id, a.allergen.strip().lower()) for a in bundle.allergens}
+        _upsert_rows(db, ProductAllergen, [
+            {"product_id": pid, "allergen": allergen} for pid, allergen in sorted(allergens)
+        ], [])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    version = catalog_cache.invalidate(db)
+    return CatalogImportResult(
+        categories=len(bundle.categories),
+        products=len(bundle.products),
+        modifiers=len(bundle.modifiers),
+        links=len(bundle.links),
+        allergens=len(allergens),
+        version=version,
+    )
+
+
+def _export_sections(db: Session):
+    """按导入顺序逐类流式读取当前目录（yield_per 分批取，不一次性载入内存）"""
+    def rows(stmt):
+        return (dict(row._mapping) for row in db.execute(stmt.execution_options(yield_per=WRITE_BATCH_SIZE)))
+
+    yield "category", "categories", rows(
+        select(ProductType.id, ProductType.name).order_by(ProductType.id))
+    yield "product", "products", rows(
+        select(Product.id, Product.name, Product.price, Product.type_id).order_by(Product.id))
+    yield "modifier", "modifiers", rows(
+        select(Modifier.id, Modifier.name, Modifier.type, Modifier.price, Modifier.is_active).order_by(Modifier.id))
+    yield "link", "links", rows(
+        select(ModifierProduct.product_id, ModifierProduct.modifier_id)
+        .order_by(ModifierProduct.product_id, ModifierProduct.modifier_id))
+    yield "allergen", "allergens", rows(
+        select(ProductAllergen.product_id, ProductAllergen.allergen)
+        .order_by(ProductAllergen.product_id, ProductAllergen.allergen))
+
+
+def iter_catalog_export(db: Session, fmt: str = "json") -> Iterator[str]:
+    """以导入相同的格式（json / csv）流式导出当前目录"""
+    if fmt == "csv":
+        yield csv_header()
+        for kind, _, records in _export_sections(db):
+            yield from csv_rows(kind, records)
+        return
+
+    yield "{"
+    for i, (_, field, records) in enumerate(_export_sections(db)):
+        yield ("," if i else "") + json.dumps(field) + ":["
+        for j, record in enumerate(records):
+            yield ("," if j else "") + json.dumps(record, default=str, ensure_ascii=False)
+        yield "]"
+    yield "}"
@@ -3,42 +3,66 @@ from typing import List, Optional, Dict, Any
 from sqlalchemy.orm import Session
 from sqlalchemy import select, and_
 from backend.models.catalog import (
-    Product, ProductType, Modifier, ModifierProduct
+    Product, Modifier, ModifierProduct
 )
 from backend.models.order import ProductAllergen
+from backend.utils.catalog_cache import catalog_cache, CategoryRow, ProductRow
+from backend.utils.search_index import product_search_index
 
-def list_categories(db: Session) -> List[ProductType]:
-    stmt = select(ProductType).order_by(ProductType.id.asc())
-    return db.execute(stmt).scalars().all()
+def list_categories(db: Session) -> List[CategoryRow]:
+    # 从进程内目录快照读取，不再每次查库
+    return list(catalog_cache.get_snapshot(db).categories)
 
 def list_products(
     db: Session,
     category_id: Optional[int] = None,
     limit: int = 100,
     offset: int = 0,
-) -> List[Product]:
-    conditions = []
-    if category_id:
-        conditions.append(Product.type_id == category_id)
+    after_id: Optional[int] = None,
+) -> List[ProductRow]:
+    # 分类筛选 + 分页直接在快照上完成；after_id 为游标分页（id > after_id）
+    return catalog_cache.get_snapshot(db).list_products(
+        category_id, limit, offset, after_id=after_id
+    )
 
-    stmt = select(Product).where(and_(*conditions) if conditions else True)\
-        .order_by(Product.id.asc())\
-        .limit(limit).offset(offset)
-    return db.execute(stmt).scalars().all()
+def search_products(db: Session, query: str, limit: int = 20) -> List[ProductRow]:
+    """产品名搜索（内存前缀索引，不走 LIKE 全表扫描）"""
+    product_search_index.ensure(catalog_cache.get_snapshot(db))
+    return product_search_index.search(query, limit)
 
-def get_product(db: Session, product_id: int) -> Optional[Product]:
-    stmt = select(Product).where(Product.id == product_id)
-    return db.execute(stmt).scalar_one_or_none()
+def get_products_with_modifiers(db: Session, product_ids: List[int]) -> List[Dict[str, Any]]:
+    """
+    批量获取产品详情（含 is_active=1 的 modifiers）
+    一次 LEFT JOIN 查询取回所有产品及其 modifier，在 Python 中按产品分组；
+    结果按传入 ids 的顺序返回（去重），不存在的 id 直接跳过
+    """
+    ids = list(dict.fromkeys(product_ids))
+    if not ids:
+        return []
 
-def get_product_modifiers(db: Session, product_id: int) -> List[Modifier]:
-    # 只返回 is_active=1 的 modifier
-    j = select(Modifier).join(
-        ModifierProduct, ModifierProduct.modifier_id == Modifier.id
+    stmt = select(Product, Modifier).outerjoin(
+        ModifierProduct, ModifierProduct.product_id == Product.id
+    ).outerjoin(
+        Modifier, and_(Modifier.id == ModifierProduct.modifier_id, Modifier.is_active == 1)
     ).where(
-        ModifierProduct.product_id == product_id,
-        Modifier.is_active == 1
-    ).order_by(Modifier.id.asc())
-    return db.execute(j).scalars().all()
+        Product.id.in_(ids)
+    ).order_by(Product.id.asc(), Modifier.id.asc())
+
+    details: Dict[int, Dict[str, Any]] = {}
+    for product, modifier in db.execute(stmt).all():
+        detail = details.get(product.id)
+        if detail is None:
+            detail = details[product.id] = {
+                "id": product.id,
+                "name": product.name,
+                "price": product.price,
+                "type_id": product.type_id,
+                "modifiers": []
+            }
+        if modifier is not None:
+            detail["modifiers"].append(modifier)
+
+    return [details[pid] for pid in ids if pid in details]
 
 
 def list_products_filtered_by_allergens(
@@ -46,34 +70,13 @@ def list_products_filtered_by_allergens(
     exclude_allergens: List[str],
     category_id: Optional[int] = None,
     limit: int = 100,
-    offset: int = 0
-) -> List[Product]:
-    """根据过敏原筛选产品列表"""
-    # 规范化过敏原名称（转小写）
-    exclude_allergens = [a.lower() for a in exclude_allergens]
-
-    # 获取包含指定过敏原的产品ID
-    if exclude_allergens:
-        excluded_product_ids = db.execute(
-            select(ProductAllergen.product_id)
-            .where(ProductAllergen.allergen.in_(exclude_allergens))
-            .distinct()
-        ).scalars().all()
-    else:
-        excluded_product_ids = []
-
-    # 查询产品，排除包含过敏原的产品
-    conditions = []
-    if excluded_product_ids:
-        conditions.append(Product.id.notin_(excluded_product_ids))
-    if category_id:
-        conditions.append(Product.type_id == category_id)
-
-    stmt = select(Product).where(and_(*conditions) if conditions else True)\
-        .order_by(Product.id.asc())\
-        .limit(limit).offset(offset)
-
-    return db.execute(stmt).scalars().all()
+    offset: int = 0,
+    after_id: Optional[int] = None,
+) -> List[ProductRow]:
+    """根据过敏原筛选产品列表（基于目录快照中的过敏原位图，不再拼 NOT IN）"""
+    return catalog_cache.get_snapshot(db).list_products(
+        category_id, limit, offset, exclude_allergens=exclude_allergens, after_id=after_id
+    )
 
 
 def get_product_allergens(db: Session, product_id: int) -> List[str]:
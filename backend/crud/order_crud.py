@@ -1,52 +1,112 @@
 # backend/crud/order_crud.py
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import select, and_, func
+from sqlalchemy import select, insert, and_, or_, func
 from decimal import Decimal
 from datetime import datetime
 import secrets
-import json
 
 from backend.models.order import (
     Order, OrderItem,
-    UserAllergen, ProductAllergen
+    UserAllergen
 )
-from backend.models.catalog import Product, Modifier
+from backend.models.catalog import Product
 from backend.models.user import User
-from backend.database import redis_client
+from backend.utils.catalog_cache import catalog_cache, CatalogSnapshot
+from backend.utils.cart_store import cart_store
 
 
-# ====== Redis 购物车操作 ======
+# ====== 购物车操作 ======
+# 行的存取交给 cart_store（Redis / 进程内 / SQL，由 CART_STORE_BACKEND 选择，见 backend/utils/cart_store.py），
+# 这里负责校验和定价。
+# 每行带有写入时的价格/名称快照及其目录版本 v；存储层同时维护总价/件数及其目录版本：
+# 目录版本没变时购物车直接从存储渲染、总价 O(1) 读取，不碰目录快照和数据库；变了才重新定价一次。
 
-def _get_cart_key(user_id: int) -> str:
-    """获取购物车的Redis key"""
-    return f"cart:user:{user_id}"
 
+def _to_cents(amount: Decimal) -> int:
+    return int((amount * 100).to_integral_value())
 
-def _get_cart_item_key(user_id: int, cart_item_id: str) -> str:
-    """获取购物车项的Redis key"""
-    return f"cart:user:{user_id}:item:{cart_item_id}"
 
+def _from_cents(cents: Any) -> Decimal:
+    return Decimal(int(cents)).scaleb(-2)
+
+
+def _modifier_snapshot(snapshot: CatalogSnapshot, modifier_ids: List[int]) -> Tuple[List[list], Decimal]:
+    """启用中的 modifier 明细 [id, name, type, price] 及单价之和；已停用或已删除的 modifier 不展示、不计价"""
+    mods = []
+    total = Decimal("0.00")
+    for modifier_id in modifier_ids:
+        modifier = snapshot.modifiers_by_id.get(modifier_id)
+        if modifier is None or modifier.is_active != 1:
+            continue
+        mods.append([modifier.id, modifier.name, modifier.type, str(modifier.price)])
+        total += modifier.price
+    return mods, total
+
+
+def _snapshot_line(snapshot: CatalogSnapshot, item_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    一行的价格/名称快照（随行一起写入存储）：
+    目录版本 v、产品名称 name、产品单价 price、modifier 明细 mods，
+    以及以分为单位的 base_cents（产品单价）/ unit_cents（含 modifiers）/ subtotal_cents（行小计）
+    产品已不存在时返回 None
+    """
+    product = snapshot.products_by_id.get(item_data["product_id"])
+    if product is None:
+        return None
+    mods, modifier_total_price = _modifier_snapshot(snapshot, item_data.get("modifiers") or [])
+    unit_cents = _to_cents(product.price + modifier_total_price)
+    return {
+        "v": str(snapshot.version),
+        "name": product.name,
+        "price": str(product.price),
+        "mods": mods,
+        "base_cents": _to_cents(product.price),
+        "unit_cents": unit_cents,
+        "subtotal_cents": unit_cents * item_data["quantity"]
+    }
+
+
+def _render_line(line: Dict[str, Any]) -> dict:
+    """直接用行内快照生成购物车项（格式与 CartItemOut 一致）"""
+    return {
+        "id": line["id"],
+        "product_id": line["product_id"],
+        "product_name": line["name"],
+        "product_price": Decimal(line["price"]),
+        "quantity": line["quantity"],
+        "modifiers": [
+            {"modifier_id": mid, "name": name, "type": mtype, "price": Decimal(price)}
+            for mid, name, mtype, price in line["mods"]
+        ],
+        "item_subtotal": _from_cents(line["subtotal_cents"])
+    }
+
+
+def _price_cart_line(snapshot: CatalogSnapshot, item_data: Dict[str, Any]) -> Optional[dict]:
+    """给一行购物车定价：行内快照与目录版本一致时直接使用，否则按目录快照重新定价；产品已不存在时返回 None"""
+    if item_data.get("v") == str(snapshot.version):
+        return _render_line(item_data)
+    fresh = _snapshot_line(snapshot, item_data)
+    if fresh is None:
+        return None
+    return _render_line(dict(item_data, **fresh))
+
+
+def add_to_cart(db: Session, user_id: int, product_id: int, quantity: int, modifier_ids: List[int], merge: bool = True) -> dict:
+    """
+    添加商品到购物车
+    merge=True 时，购物车里已有相同配置（产品 + modifier 集合）的行就直接给它加数量，不新建一行
+    返回定价后的购物车项（新行或合并后的行，格式与 get_cart_items_with_details 中的元素相同），调用方不需要再读整个购物车
+    """
+    snapshot = catalog_cache.get_snapshot(db)
 
-def add_to_cart(db: Session, user_id: int, product_id: int, quantity: int, modifier_ids: List[int]) -> Dict[str, Any]:
-    """添加商品到购物车 (Redis)"""
     # 验证产品存在
-    product = db.execute(select(Product).where(Product.id == product_id)).scalar_one_or_none()
-    if not product:
+    if product_id not in snapshot.products_by_id:
         raise ValueError("Product not found")
 
-    # 验证所有modifier存在且有效
-    if modifier_ids:
-        modifiers = db.execute(
-            select(Modifier).where(
-                Modifier.id.in_(modifier_ids),
-                Modifier.is_active == 1
-            )
-        ).scalars().all()
-        if len(modifiers) != len(modifier_ids):
-            raise ValueError("Some modifiers are invalid or inactive")
-
-    # 创建购物车项
+    # 验证所有modifier有效，且可以用在这个产品上（兼容性索引，不查库）
+    snapshot.modifier_compat.validate(product_id, modifier_ids)
 
     # 生成购物车项ID（时间戳 + 随机数）
     cart_item_id = f"{int(datetime.now().timestamp() * 1000)}_{secrets.token_hex(4)}"
@@ -59,162 +119,114 @@ def add_to_cart(db: Session, user_id: int, product_id: int, quantity: int, modif
         "modifiers": modifier_ids,
         "created_at": datetime.now().isoformat()
     }
-
-    # 存储到Redis
-    cart_key = _get_cart_key(user_id)
-    item_key = _get_cart_item_key(user_id, cart_item_id)
-
-    # 存储购物车项数据
-    redis_client.set(item_key, json.dumps(cart_item_data), ex=7200)  # 2小时过期
-
-    # 将购物车项ID添加到用户购物车集合
-    redis_client.sadd(cart_key, cart_item_id)
-    redis_client.expire(cart_key, 7200)  # 2小时过期
-
-    return cart_item_data
-
-
-def get_cart_items_with_details(db: Session, user_id: int) -> List[dict]:
-    """获取购物车详情（包含产品和modifier信息）- Redis版本"""
-    cart_key = _get_cart_key(user_id)
-
-    # 获取购物车中所有项的ID
-    cart_item_ids = redis_client.smembers(cart_key)
-    if not cart_item_ids:
-        return []
-
+    cart_item_data.update(_snapshot_line(snapshot, cart_item_data))
+
+    stored = cart_store.add_line(user_id, cart_item_data, str(snapshot.version), merge)
+    return _price_cart_line(snapshot, stored)
+
+
+def get_cart_with_totals(db: Session, user_id: int) -> Tuple[List[dict], Decimal, int]:
+    """
+    获取购物车详情（包含产品和modifier信息）及总价、件数
+    一次读取取出所有行和总价：
+    - 每行的快照版本、总价的版本都与当前目录版本一致时，完全从存储渲染（不碰目录快照、不查库）
+    - 否则只对版本过期的行用目录快照重新定价（产品已被删除的行直接移除），写回后之后的读取又回到快速路径
+    返回 (购物车项列表, 总价, 件数)
+    """
+    state = cart_store.load(user_id)
+    if not state.lines:
+        return [], Decimal("0.00"), 0
+
+    totals = state.totals
+    version = str(catalog_cache.version)
+    if totals.version == version and all(line.get("v") == version for line in state.lines.values()):
+        items = [_render_line(line) for line in state.lines.values()]
+        return items, _from_cents(totals.subtotal_cents), totals.count
+
+    snapshot = catalog_cache.get_snapshot(db)
+    version = str(snapshot.version)
     result = []
-    for cart_item_id in cart_item_ids:
-        item_key = _get_cart_item_key(user_id, cart_item_id)
-        item_data_str = redis_client.get(item_key)
+    lines = {}
+    stale_ids = []
+    repriced = False
+    # 存储按加入购物车的先后返回各行
+    for cart_item_id, line in state.lines.items():
+        if line.get("v") != version:
+            fresh = _snapshot_line(snapshot, line)
+            if fresh is None:
+                # 产品不存在，删除购物车项
+                stale_ids.append(cart_item_id)
+                continue
+            line = dict(line, **fresh)
+            repriced = True
+        lines[cart_item_id] = line
+        result.append(_render_line(line))
+
+    if totals.version == version and not repriced and not stale_ids:
+        return result, _from_cents(totals.subtotal_cents), totals.count
+
+    subtotal, count = cart_store.reprice(user_id, state, version, lines, stale_ids)
+    return result, _from_cents(subtotal), count
 
-        if not item_data_str:
-            # 如果项不存在，从集合中移除
-            redis_client.srem(cart_key, cart_item_id)
-            continue
 
-        item_data = json.loads(item_data_str)
-
-        # 获取产品信息
-        product = db.execute(
-            select(Product).where(Product.id == item_data["product_id"])
-        ).scalar_one_or_none()
-
-        if not product:
-            # 产品不存在，删除购物车项
-            redis_client.delete(item_key)
-            redis_client.srem(cart_key, cart_item_id)
-            continue
+def get_cart_items_with_details(db: Session, user_id: int) -> List[dict]:
+    """获取购物车详情（包含产品和modifier信息）"""
+    return get_cart_with_totals(db, user_id)[0]
 
-        # 获取modifiers信息
-        modifiers = []
-        modifier_total_price = Decimal("0.00")
-
-        if item_data.get("modifiers"):
-            modifier_objs = db.execute(
-                select(Modifier).where(
-                    Modifier.id.in_(item_data["modifiers"]),
-                    Modifier.is_active == 1
-                )
-            ).scalars().all()
-
-            for modifier in modifier_objs:
-                modifiers.append({
-                    "modifier_id": modifier.id,
-                    "name": modifier.name,
-                    "type": modifier.type,
-                    "price": modifier.price
-                })
-                modifier_total_price += modifier.price
-
-        # 计算小计
-        item_subtotal = (product.price + modifier_total_price) * item_data["quantity"]
-
-        result.append({
-            "id": item_data["id"],
-            "product_id": product.id,
-            "product_name": product.name,
-            "product_price": product.price,
-            "quantity": item_data["quantity"],
-            "modifiers": modifiers,
-            "item_subtotal": item_subtotal
-        })
 
-    return result
+def get_cart_summary(db: Session, user_id: int) -> Tuple[Decimal, int]:
+    """
+    购物车总价和件数：直接读存储维护的值（O(1)，与购物车行数无关）；
+    目录版本已变化（或存储不维护总价）时退回到完整读取并重新定价
+    返回 (总价, 件数)
+    """
+    totals = cart_store.totals(user_id)
+    if totals and totals.version and totals.version == str(catalog_cache.get_snapshot(db).version):
+        return _from_cents(totals.subtotal_cents), totals.count
+    _, total, count = get_cart_with_totals(db, user_id)
+    return total, count
 
 
-def update_cart_item(db: Session, cart_item_id: str, user_id: int, quantity: Optional[int], modifier_ids: Optional[List[int]]) -> Dict[str, Any]:
-    """更新购物车项 - Redis版本"""
-    cart_key = _get_cart_key(user_id)
-    item_key = _get_cart_item_key(user_id, cart_item_id)
+def update_cart_item(db: Session, cart_item_id: str, user_id: int, quantity: Optional[int], modifier_ids: Optional[List[int]]) -> dict:
+    """更新购物车项；返回定价后的购物车项"""
+    snapshot = catalog_cache.get_snapshot(db)
 
-    # 检查购物车项是否存在
-    if not redis_client.sismember(cart_key, cart_item_id):
+    # 更新modifiers时，先按这一行的产品验证兼容性（只改数量时不需要读取这一行）
+    if modifier_ids:
+        product_id = cart_store.get_product_id(user_id, cart_item_id)
+        if product_id is None:
+            raise ValueError("Cart item not found or not owned by user")
+        snapshot.modifier_compat.validate(product_id, modifier_ids)
+    mods, mods_total = _modifier_snapshot(snapshot, modifier_ids or [])
+
+    stored = cart_store.update_line(
+        user_id, cart_item_id, quantity, modifier_ids, mods, _to_cents(mods_total), str(snapshot.version)
+    )
+    if stored is None:
         raise ValueError("Cart item not found or not owned by user")
 
-    item_data_str = redis_client.get(item_key)
-    if not item_data_str:
-        raise ValueError("Cart item not found")
-
-    item_data = json.loads(item_data_str)
-
-    # 更新数量
-    if quantity is not None:
-        item_data["quantity"] = quantity
-
-    # 更新modifiers
-    if modifier_ids is not None:
-        # 验证所有modifier存在且有效
-        if modifier_ids:
-            modifiers = db.execute(
-                select(Modifier).where(
-                    Modifier.id.in_(modifier_ids),
-                    Modifier.is_active == 1
-                )
-            ).scalars().all()
-            if len(modifiers) != len(modifier_ids):
-                raise ValueError("Some modifiers are invalid or inactive")
-
-        item_data["modifiers"] = modifier_ids
-
-    item_data["updated_at"] = datetime.now().isoformat()
+    priced = _price_cart_line(snapshot, stored)
+    if priced is None:
+        # 产品已被删除：与读取购物车时一样，顺手清掉这一行
+        cart_store.remove_line(user_id, cart_item_id)
+        raise ValueError("Product not found")
+    return priced
 
-    # 更新Redis
-    redis_client.set(item_key, json.dumps(item_data), ex=7200)  # 2小时过期
 
-    return item_data
+def get_cart_total(db: Session, user_id: int) -> Decimal:
+    """购物车总价"""
+    return get_cart_summary(db, user_id)[0]
 
 
 def remove_from_cart(db: Session, cart_item_id: str, user_id: int):
-    """从购物车移除商品 - Redis版本"""
-    cart_key = _get_cart_key(user_id)
-    item_key = _get_cart_item_key(user_id, cart_item_id)
-
-    # 检查购物车项是否存在
-    if not redis_client.sismember(cart_key, cart_item_id):
+    """从购物车移除商品"""
+    if not cart_store.remove_line(user_id, cart_item_id):
         raise ValueError("Cart item not found or not owned by user")
 
-    # 删除购物车项数据
-    redis_client.delete(item_key)
-
-    # 从购物车集合中移除
-    redis_client.srem(cart_key, cart_item_id)
-
 
 def clear_cart(db: Session, user_id: int):
-    """清空购物车 - Redis版本"""
-    cart_key = _get_cart_key(user_id)
-
-    # 获取所有购物车项ID
-    cart_item_ids = redis_client.smembers(cart_key)
-
-    # 删除所有购物车项
-    for cart_item_id in cart_item_ids:
-        item_key = _get_cart_item_key(user_id, cart_item_id)
-        redis_client.delete(item_key)
-
-    # 删除购物车集合
-    redis_client.delete(cart_key)
+    """清空购物车"""
+    cart_store.clear(user_id)
 
 
 # ====== 订单操作 ======
@@ -226,8 +238,58 @@ def generate_order_number() -> str:
     return f"ORD{timestamp}{random_str}"
 
 
-def create_order_from_cart(db: Session, user_id: int, payment_method: str = 'cash', dine_option: str = 'take_out') -> Order:
-    """从购物车创建订单"""
+# 结算时每条 INSERT 最多携带的订单项行数（多行 VALUES）
+ORDER_ITEM_INSERT_BATCH_SIZE = 500
+
+
+def _insert_order_items(db: Session, rows: List[dict]) -> List[int]:
+    """
+    多行 INSERT 写入订单项，每 ORDER_ITEM_INSERT_BATCH_SIZE 行一条语句，返回按 rows 顺序的订单项ID
+    MySQL 的 lastrowid 是这条语句生成的第一个自增ID；InnoDB 对行数已知的单条多行 INSERT 分配连续的ID
+    （auto_increment_increment 保持默认的 1），所以其余ID可以直接推出，不需要再查询
+    """
+    ids = []
+    for i in range(0, len(rows), ORDER_ITEM_INSERT_BATCH_SIZE):
+        chunk = rows[i:i + ORDER_ITEM_INSERT_BATCH_SIZE]
+        first_id = db.execute(insert(OrderItem).values(chunk)).lastrowid
+        ids.extend(range(first_id, first_id + len(chunk)))
+    return ids
+
+
+def _order_modifier(modifier: Dict[str, Any]) -> dict:
+    """
+    订单项中 modifier 的统一格式（与 OrderItemModifierOut 一致）
+    兼容旧订单保存的 name / type / price 键
+    """
+    return {
+        "modifier_id": modifier["modifier_id"],
+        "modifier_name": modifier.get("modifier_name", modifier.get("name")),
+        "modifier_type": modifier.get("modifier_type", modifier.get("type")),
+        "modifier_price": Decimal(str(modifier.get("modifier_price", modifier.get("price")))),
+    }
+
+
+def _order_detail(order: Order, items: List[dict]) -> dict:
+    """订单详情（格式与 OrderOut 一致）"""
+    return {
+        "id": order.id,
+        "order_number": order.order_number,
+        "user_id": order.user_id,
+        "total_price": order.total_price,
+        "order_status": order.order_status,
+        "payment_method": order.payment_method,
+        "dine_option": order.dine_option,
+        "items": items,
+        "created_at": order.created_at
+    }
+
+
+def create_order_from_cart(db: Session, user_id: int, payment_method: str = 'cash', dine_option: str = 'take_out') -> dict:
+    """
+    从购物车创建订单
+    订单头一条 INSERT、订单项多行 INSERT；created_at 等默认值在这里显式给出，写入后不需要 refresh
+    返回订单详情（格式与 get_order_with_details 相同），全部来自已定价的购物车和写入的值，调用方不需要再查询
+    """
     # 获取购物车详情
     cart_items = get_cart_items_with_details(db, user_id)
     if not cart_items:
@@ -236,39 +298,100 @@ def create_order_from_cart(db: Session, user_id: int, payment_method: str = 'cas
     # 计算总价
     total_price = sum(item["item_subtotal"] for item in cart_items)
 
-    # 创建订单
-    order = Order(
-        order_number=generate_order_number(),
-        user_id=user_id,
-        pickup_number=None,  # 可以后续生成
-        payment_method=payment_method,
-        dine_option=dine_option,
-        total_price=total_price,
-        order_status="IP"  # In Progress
-    )
-    db.add(order)
-    db.flush()
-
-    # 创建订单项
-    for item in cart_items:
-        # 将modifiers转换为JSON格式存储
-        modifiers_json = item["modifiers"] if item["modifiers"] else None
-
-        order_item = OrderItem(
-            order_id=order.id,
-            product_id=item["product_id"],
-            quantity=item["quantity"],
-            modifiers=modifiers_json,
-            price=item["item_subtotal"]
-        )
-        db.add(order_item)
-
-    # 清空购物车
-    clear_cart(db, user_id)
+    # DateTime 列不带小数秒，与数据库中保存的值保持一致
+    now = datetime.now().replace(microsecond=0)
+    header = {
+        "order_number": generate_order_number(),
+        "user_id": user_id,
+        "pickup_number": None,  # 可以后续生成
+        "payment_method": payment_method,
+        "dine_option": dine_option,
+        "total_price": total_price,
+        "order_status": "IP",  # In Progress
+        "created_at": now,
+        "updated_at": now,
+    }
+    order_id = db.execute(insert(Order).values(header)).lastrowid
+
+    # 创建订单项（modifiers 以 JSON 存储，价格转成字符串）
+    modifiers = [
+        [_order_modifier(mod) for mod in item["modifiers"]]
+        for item in cart_items
+    ]
+    rows = [
+        {
+            "order_id": order_id,
+            "product_id": item["product_id"],
+            "quantity": item["quantity"],
+            "modifiers": [dict(mod, modifier_price=str(mod["modifier_price"])) for mod in mods] or None,
+            "price": item["item_subtotal"],
+            "created_at": now,
+        }
+        for item, mods in zip(cart_items, modifiers)
+    ]
+    item_ids = _insert_order_items(db, rows)
 
     db.commit()
-    db.refresh(order)
-    return order
+
+    # 订单写入成功后再清空购物车（提交失败时购物车保留，用户可以重试）
+    # 订单已经提交：清空失败也照常返回订单，不能让客户端当作下单失败而重试（购物车会在 TTL 后过期）
+    try:
+        clear_cart(db, user_id)
+    except Exception as e:
+        print(f"订单 {header['order_number']} 已创建，但清空购物车失败: {e}")
+
+    items = [
+        {
+            "id": item_id,
+            "product_id": item["product_id"],
+            "product_name": item["product_name"],
+            "quantity": item["quantity"],
+            "modifiers": mods,
+            "price": item["item_subtotal"]
+        }
+        for item_id, item, mods in zip(item_ids, cart_items, modifiers)
+    ]
+    # 不挂在 session 上的 Order，只用来组装返回值
+    return _order_detail(Order(id=order_id, **header), items)
+
+
+def load_order_items(db: Session, order_ids: List[int]) -> Dict[int, List[dict]]:
+    """
+    批量读取订单项：{order_id: [订单项, ...]}（订单项格式与 get_order_with_details 中的相同）
+    不论订单数量多少都只执行两条查询：所有订单项一次 IN 查询，涉及的产品名称一次 IN 查询
+    """
+    items_by_order: Dict[int, List[dict]] = {order_id: [] for order_id in order_ids}
+    if not order_ids:
+        return items_by_order
+
+    order_items = db.execute(
+        select(OrderItem)
+        .where(OrderItem.order_id.in_(order_ids))
+        .order_by(OrderItem.id)
+    ).scalars().all()
+
+    product_ids = {item.product_id for item in order_items}
+    product_names = dict(
+        db.execute(select(Product.id, Product.name).where(Product.id.in_(product_ids))).all()
+    ) if product_ids else {}
+
+    for item in order_items:
+        # modifiers已经是JSON格式存储的
+        items_by_order[item.order_id].append({
+            "id": item.id,
+            "product_id": item.product_id,
+            "product_name": product_names.get(item.product_id, "Unknown Product"),
+            "quantity": item.quantity,
+            "modifiers": [_order_modifier(mod) for mod in item.modifiers or []],
+            "price": item.price
+        })
+    return items_by_order
+
+
+def load_order_details(db: Session, orders: List[Order]) -> List[dict]:
+    """批量组装订单详情（顺序与 orders 相同，格式与 get_order_with_details 相同）"""
+    items_by_order = load_order_items(db, [order.id for order in orders])
+    return [_order_detail(order, items_by_order[order.id]) for order in orders]
 
 
 def get_order_with_details(db: Session, order_id: int, user_id: Optional[int] = None) -> Optional[dict]:
@@ -280,49 +403,60 @@ def get_order_with_details(db: Session, order_id: int, user_id: Optional[int] =
     order = db.execute(query).scalar_one_or_none()
     if not order:
         return None
+    return load_order_details(db, [order])[0]
 
-    # 获取订单项
-    order_items = db.execute(
-        select(OrderItem).where(OrderItem.order_id == order.id)
-    ).scalars().all()
 
-    items = []
-    for item in order_items:
-        # 获取产品信息
-        product = db.execute(select(Product).where(Product.id == item.product_id)).scalar_one_or_none()
-        product_name = product.name if product else "Unknown Product"
-
-        # modifiers已经是JSON格式存储的
-        modifiers = item.modifiers if item.modifiers else []
+# 订单列表可选的字段（fields=），以及 view=summary 返回的字段
+ORDER_LIST_FIELDS = (
+    "id", "order_number", "user_id", "total_price", "order_status",
+    "payment_method", "dine_option", "items", "created_at"
+)
+ORDER_SUMMARY_FIELDS = ("id", "order_number", "total_price", "order_status", "created_at")
 
-        items.append({
-            "id": item.id,
-            "product_id": item.product_id,
-            "product_name": product_name,
-            "quantity": item.quantity,
-            "modifiers": modifiers,
-            "price": item.price
-        })
 
-    return {
-        "id": order.id,
-        "order_number": order.order_number,
-        "user_id": order.user_id,
-        "total_price": order.total_price,
-        "order_status": order.order_status,
-        "payment_method": order.payment_method,
-        "dine_option": order.dine_option,
-        "items": items,
-        "created_at": order.created_at
-    }
+def resolve_order_fields(fields: Optional[str], view: str = "full") -> List[str]:
+    """
+    订单列表要返回的字段：fields（逗号分隔）优先，否则按 view（full / summary）
+    有未知字段时抛 ValueError
+    """
+    if not fields:
+        return list(ORDER_SUMMARY_FIELDS if view == "summary" else ORDER_LIST_FIELDS)
+    selected = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in selected if f not in ORDER_LIST_FIELDS]
+    if unknown or not selected:
+        raise ValueError(f"Unknown order fields: {', '.join(unknown)}" if unknown else "No order fields selected")
+    return selected
 
 
-def list_user_orders(db: Session, user_id: int, limit: int = 50, offset: int = 0) -> List[Order]:
-    """获取用户订单列表"""
-    stmt = select(Order).where(Order.user_id == user_id)\
-        .order_by(Order.created_at.desc())\
+def list_user_orders(
+    db: Session,
+    user_id: int,
+    limit: int = 50,
+    offset: int = 0,
+    after: Optional[Tuple[datetime, int]] = None,
+    columns: Optional[List[str]] = None,
+) -> List[Order]:
+    """
+    获取用户订单列表（按 created_at, id 倒序）
+    after 为游标分页：上一页最后一条的 (created_at, id)，走 idx_orders_user_created 索引直接定位
+    columns 给出时只查询这些列（另加游标需要的 id、created_at），返回的行同样按属性访问
+    """
+    if columns is None:
+        stmt = select(Order)
+    else:
+        names = dict.fromkeys(["id", "created_at", *columns])
+        stmt = select(*(getattr(Order, name) for name in names))
+    stmt = stmt.where(Order.user_id == user_id)
+    if after is not None:
+        created_at, order_id = after
+        stmt = stmt.where(or_(
+            Order.created_at < created_at,
+            and_(Order.created_at == created_at, Order.id < order_id)
+        ))
+    stmt = stmt.order_by(Order.created_at.desc(), Order.id.desc())\
         .limit(limit).offset(offset)
-    return db.execute(stmt).scalars().all()
+    result = db.execute(stmt)
+    return result.scalars().all() if columns is None else result.all()
 
 
 # ====== 过敏原操作 ======
@@ -355,46 +489,19 @@ def get_products_by_allergen_filter(
     limit: int = 100,
     offset: int = 0
 ) -> List[dict]:
-    """根据过敏原筛选产品"""
-    # 规范化过敏原名称（转小写）
-    exclude_allergens = [a.lower() for a in exclude_allergens]
-
-    # 获取包含指定过敏原的产品ID
-    if exclude_allergens:
-        excluded_product_ids = db.execute(
-            select(ProductAllergen.product_id)
-            .where(ProductAllergen.allergen.in_(exclude_allergens))
-            .distinct()
-        ).scalars().all()
-    else:
-        excluded_product_ids = []
-
-    # 查询产品，排除包含过敏原的产品
-    conditions = []
-    if excluded_product_ids:
-        conditions.append(Product.id.notin_(excluded_product_ids))
-    if category_id:
-        conditions.append(Product.type_id == category_id)
-
-    stmt = select(Product).where(and_(*conditions) if conditions else True)\
-        .order_by(Product.id.asc())\
-        .limit(limit).offset(offset)
-
-    products = db.execute(stmt).scalars().all()
-
-    # 为每个产品添加过敏原信息
-    result = []
-    for product in products:
-        allergens = db.execute(
-            select(ProductAllergen.allergen).where(ProductAllergen.product_id == product.id)
-        ).scalars().all()
+    """根据过敏原筛选产品（过敏原位图 + 目录快照，无需逐个产品查询过敏原）"""
+    snapshot = catalog_cache.get_snapshot(db)
+    products = snapshot.list_products(
+        category_id, limit, offset, exclude_allergens=exclude_allergens
+    )
 
-        result.append({
+    return [
+        {
             "id": product.id,
             "name": product.name,
             "price": product.price,
             "type_id": product.type_id,
-            "allergens": list(allergens)
-        })
-
-    return result
+            "allergens": snapshot.allergens_of(product.id)
+        }
+        for product in products
+    ]
@@ -1,14 +1,20 @@
 # backend/routers/admin_catalog_router.py
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from backend.database import SessionLocal
 from backend.utils.auth_dependencies import require_roles
+from backend.utils.catalog_bundle import parse_csv_bundle
 from backend.schemas.catalog_schemas import (
     ProductCreate, ProductUpdate, ProductOut,
     ModifierCreate, ModifierUpdate, ModifierOut,
     ProductTypeCreate, ProductTypeOut,
-    AttachModifierRequest
+    AttachModifierRequest, SyncModifiersRequest, SyncModifiersResult,
+    CatalogBundle, CatalogImportResult
 )
 from backend.crud import admin_catalog_crud, catalog_crud
 
@@ -232,3 +238,102 @@ def detach_modifier(
 ):
     deleted = admin_catalog_crud.detach_modifier(db, product_id, modifier_id)
     return {"detached": bool(deleted)}
+
+
+# 接口说明：
+# 功能：声明式设置一个或多个产品的「完整」修饰项集合。
+#       服务端与 modifier_product 现有记录比对，缺的批量补上（多行 INSERT IGNORE），
+#       多的批量删除（DELETE ... IN），整体一个事务，目录缓存只失效一次。
+#       例如给 40 款饮品统一设置 12 种加料，只需一次请求。
+# URL：PUT /admin/catalog/products/modifiers
+# 请求体格式：JSON，对应 SyncModifiersRequest，例如：
+#   {
+#     "product_ids": [1, 2, 3],
+#     "modifier_ids": [3, 4, 5]   // 传空列表表示清空这些产品的所有修饰项
+#   }
+# 返回：{"attached": 新增关联数, "detached": 删除关联数}
+# 权限：需要 Authorization: Bearer <staff_token>，角色 owner 或 manager
+@router.put("/products/modifiers", response_model=SyncModifiersResult)
+def sync_product_modifiers(
+    payload: SyncModifiersRequest,
+    db: Session = Depends(get_db),
+    _=Depends(require_roles(["owner", "manager"])),
+):
+    modifier_sets = {pid: payload.modifier_ids for pid in payload.product_ids}
+    try:
+        return admin_catalog_crud.sync_product_modifiers(db, modifier_sets)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+# ---------- 批量导入 / 导出 ----------
+
+# 接口说明：
+# 功能：批量导入整份（或部分）目录：分类、产品、修饰项、产品-修饰项关联、产品过敏原。
+#       先整体校验（重复 id、引用不存在的分类/产品/修饰项），全部通过后在一个事务里
+#       用多行 INSERT ... ON DUPLICATE KEY UPDATE 批量写入，结束时只失效一次目录缓存。
+# URL：POST /admin/catalog/import
+# 请求体格式（二选一）：
+#   1) Content-Type: application/json，对应 CatalogBundle，例如：
+#     {
+#       "categories": [{"id": 1, "name": "Milk Tea"}],
+#       "products":   [{"id": 10, "name": "Taro Latte", "price": 6.00, "type_id": 1}],
+#       "modifiers":  [{"id": 3, "name": "Large", "type": "size", "price": 1.00, "is_active": 1}],
+#       "links":      [{"product_id": 10, "modifier_id": 3}],
+#       "allergens":  [{"product_id": 10, "allergen": "milk"}]
+#     }
+#   2) Content-Type: text/csv（或 ?format=csv），列为
+#     kind,id,name,price,type_id,type,is_active,product_id,modifier_id,allergen
+#     kind 取 category / product / modifier / link / allergen
+# 说明：所有实体必须带 id，已存在则更新，不存在则插入；关联和过敏原已存在则跳过
+# 权限：需要 Authorization: Bearer <staff_token>，角色 owner 或 manager
+@router.post("/import", response_model=CatalogImportResult)
+async def import_catalog(
+    request: Request,
+    format: str = Query(None, pattern="^(json|csv)$"),
+    db: Session = Depends(get_db),
+    _=Depends(require_roles(["owner", "manager"])),
+):
+    content_type = request.headers.get("content-type", "")
+    body = await request.body()
+    try:
+        if format == "csv" or (format is None and "csv" in content_type):
+            bundle = parse_csv_bundle(body.decode("utf-8-sig"))
+        else:
+            bundle = CatalogBundle.model_validate_json(body)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=jsonable_encoder(e.errors(include_url=False)))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        return await run_in_threadpool(admin_catalog_crud.import_catalog, db, bundle)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# 接口说明：
+# 功能：流式导出当前整份目录，格式与导入接口相同（导出结果可以直接再导入）
+# URL：GET /admin/catalog/export?format=json|csv
+# 查询参数：
+#   format：可选，json（默认）或 csv
+# 权限：需要 Authorization: Bearer <staff_token>，角色 owner 或 manager
+@router.get("/export")
+def export_catalog(
+    format: str = Query("json", pattern="^(json|csv)$"),
+    _=Depends(require_roles(["owner", "manager"])),
+):
+    def stream():
+        # 流式响应在依赖退出后才开始发送，这里自己管理 Session 的生命周期
+        db = SessionLocal()
+        try:
+            yield from admin_catalog_crud.iter_catalog_export(db, format)
+        finally:
+            db.close()
+
+    media_type = "text/csv" if format == "csv" else "application/json"
+    filename = f"catalog.{format}"
+    return StreamingResponse(
+        stream(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -1,15 +1,23 @@
 # backend/routers/catalog_router.py
 from typing import List, Optional
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
 from backend.database import SessionLocal
 from backend.schemas.catalog_schemas import (
     ProductQuery, ProductOut, ProductDetail, ProductTypeOut, ModifierOut
 )
 from backend.crud import catalog_crud
+from backend.utils.http_cache import (
+    catalog_etag, catalog_cache_control, etag_matches, not_modified, set_cache_headers
+)
+from backend.utils.menu_document import get_menu_document, negotiate_encoding
+from backend.utils.pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_id_cursor
 
 router = APIRouter(prefix="/catalog", tags=["Catalog"])
 
+# 批量产品详情接口一次最多接受的 ID 数量
+MAX_BATCH_IDS = 200
+
 def get_db():
     db = SessionLocal()
     try:
@@ -25,9 +33,14 @@ def get_db():
 # URL：GET /catalog/categories
 # 路径参数：无
 # 请求体格式：无（GET 无 Body）
+# 缓存：响应带 ETag（目录版本号）与 Cache-Control；请求带 If-None-Match 且未变化时返回 304
 # 权限：不需要 Authorization（公开接口）
 @router.get("/categories", response_model=List[ProductTypeOut])
-def list_categories(db: Session = Depends(get_db)):
+def list_categories(request: Request, response: Response, db: Session = Depends(get_db)):
+    etag = catalog_etag()
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_cache_headers(response, etag)
     return catalog_crud.list_categories(db)
 
 # ---------------------------------------------------------
@@ -39,19 +52,88 @@ def list_categories(db: Session = Depends(get_db)):
 # 查询参数（Query Params）：
 #   categoryId：可选，分类 ID（数字）
 #   limit：可选，每页数量（默认 100）
-#   offset：可选，偏移量（默认 0）
+#   offset：可选，偏移量（默认 0，保留兼容；推荐使用 cursor）
+#   cursor：可选，游标（取上一页响应头 X-Next-Cursor 的值），任何深度翻页代价相同
 # 请求体格式：无（使用 Query 参数）
+# 响应头：X-Next-Cursor：本页已满时返回下一页游标
+# 缓存：响应带 ETag（目录版本号）与 Cache-Control；请求带 If-None-Match 且未变化时返回 304
 # 权限：不需要 Authorization（公开接口）
 @router.get("/products", response_model=List[ProductOut])
 def list_products(
+    request: Request,
+    response: Response,
     categoryId: Optional[int] = Query(None),
     limit: int = Query(100, ge=1, le=500),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None),
     db: Session = Depends(get_db),
 ):
-    items = catalog_crud.list_products(db, category_id=categoryId, limit=limit, offset=offset)
+    try:
+        after_id = decode_id_cursor(cursor, "product")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    etag = catalog_etag()
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_cache_headers(response, etag)
+    items = catalog_crud.list_products(
+        db, category_id=categoryId, limit=limit, offset=offset, after_id=after_id
+    )
+    if len(items) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor("product", items[-1].id)
     return items
 
+# ---------------------------------------------------------
+# 搜索产品（按名称前缀）
+# ---------------------------------------------------------
+# 接口说明：
+# 功能：kiosk / 收银台的菜单搜索，如 "brown sug"、"taro"、"奶茶"、"zhenzhu"。
+#       大小写、重音不敏感；多个词时每个词都要匹配某个词的前缀。基于内存索引，不走数据库 LIKE。
+# URL：GET /catalog/search?q=brown%20sug&limit=20
+# 查询参数（Query Params）：
+#   q：必填，搜索词
+#   limit：可选，最多返回数量（默认 20）
+# 权限：不需要 Authorization（公开接口）
+@router.get("/search", response_model=List[ProductOut])
+def search_products(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    return catalog_crud.search_products(db, q, limit)
+
+# ---------------------------------------------------------
+# 批量获取产品详情（含 modifiers）
+# ---------------------------------------------------------
+# 接口说明：
+# 功能：一次请求获取多个产品的详情及其启用的 modifier（kiosk 一屏几十个产品时使用）。
+#       后端只执行一次 JOIN 查询，不再每个产品查两次。
+# URL：GET /catalog/products:batch?ids=1,2,3
+# 查询参数（Query Params）：
+#   ids：必填，产品 ID 列表，逗号分隔（最多 200 个）
+# 响应：按 ids 顺序返回 ProductDetail 列表，不存在的 ID 会被忽略
+# 缓存：响应带 ETag（目录版本号）与 Cache-Control；未变化时返回 304
+# 权限：不需要 Authorization（公开接口）
+@router.get("/products:batch", response_model=List[ProductDetail])
+def get_products_batch(
+    request: Request,
+    response: Response,
+    ids: str = Query(..., description="逗号分隔的产品 ID"),
+    db: Session = Depends(get_db),
+):
+    try:
+        product_ids = [int(x) for x in ids.split(",") if x.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be comma separated integers")
+    if len(product_ids) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} ids per request")
+
+    etag = catalog_etag()
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_cache_headers(response, etag)
+    return catalog_crud.get_products_with_modifiers(db, product_ids)
+
 # ---------------------------------------------------------
 # 获取产品详情（含 modifiers）
 # ---------------------------------------------------------
@@ -61,18 +143,57 @@ def list_products(
 # 路径参数：
 #   product_id：产品 ID
 # 请求体格式：无
+# 缓存：响应带 ETag（目录版本号）与 Cache-Control；请求带 If-None-Match 且未变化时返回 304
 # 权限：不需要 Authorization（公开接口）
 @router.get("/products/{product_id}", response_model=ProductDetail)
-def get_product(product_id: int, db: Session = Depends(get_db)):
-    p = catalog_crud.get_product(db, product_id)
-    if not p:
-        from fastapi import HTTPException
+def get_product(product_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    etag = catalog_etag()
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    # 与批量接口走同一条路径：一次 JOIN 查询拿到产品和 modifiers
+    details = catalog_crud.get_products_with_modifiers(db, [product_id])
+    if not details:
         raise HTTPException(status_code=404, detail="Product not found")
-    modifiers = catalog_crud.get_product_modifiers(db, product_id)
-    return {
-        "id": p.id,
-        "name": p.name,
-        "price": p.price,
-        "type_id": p.type_id,
-        "modifiers": modifiers
+    set_cache_headers(response, etag)
+    return details[0]
+
+# ---------------------------------------------------------
+# 获取整份菜单文档（分类 + 产品 + modifiers + 过敏原）
+# ---------------------------------------------------------
+# 接口说明：
+# 功能：一次请求拿到渲染菜单所需的全部数据，替代 categories + products + N 次产品详情。
+#       文档按目录版本预编译为 bytes，并预先压缩好 gzip / brotli 版本，请求时只做内存拷贝。
+# URL：GET /catalog/menu-document
+# 请求体格式：无
+# 响应格式：
+#   {
+#     "version": 123,
+#     "categories": [
+#       {"id": 1, "name": "Milk Tea", "products": [
+#         {"id": 1, "name": "...", "price": "5.50", "type_id": 1,
+#          "allergens": ["milk"], "modifiers": [{"id": 3, "name": "Large", "type": "size", "price": "1.00", "is_active": 1}]}
+#       ]}
+#     ],
+#     "uncategorized": []   // 分类已删除但仍存在的产品
+#   }
+# 缓存：按 Accept-Encoding 返回 br / gzip / 原文；带 ETag 与 Cache-Control，未变化时返回 304
+# 权限：不需要 Authorization（公开接口）
+@router.get("/menu-document")
+def get_menu_document_route(request: Request, db: Session = Depends(get_db)):
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    variant = f"menu-{encoding or 'identity'}"
+    etag = catalog_etag(variant)
+    if etag_matches(request, etag):
+        response = not_modified(etag)
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    document = get_menu_document(db)
+    headers = {
+        "ETag": catalog_etag(variant, version=document.version),
+        "Cache-Control": catalog_cache_control(),
+        "Vary": "Accept-Encoding",
     }
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=document.body(encoding), media_type="application/json", headers=headers)
@@ -1,17 +1,24 @@
 # backend/routers/order_router.py
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
 from sqlalchemy.orm import Session
 from backend.database import SessionLocal
 from backend.schemas.order_schemas import (
-    AddToCartRequest, UpdateCartItemRequest, CartOut, CartItemOut,
-    CreateOrderRequest, OrderOut, OrderItemOut, OrderItemModifierOut,
+    AddToCartRequest, UpdateCartItemRequest, CartOut, CartItemOut, CartItemWriteOut, CartSummaryOut,
+    CreateOrderRequest, OrderOut, OrderListOut, OrderItemOut, OrderItemModifierOut,
     AllergenFilterRequest, UserAllergenOut, UpdateUserAllergensRequest,
     ProductWithAllergens, ModifierInCart
 )
 from backend.schemas.catalog_schemas import ProductOut, ProductDetail
 from backend.crud import order_crud, catalog_crud
 from backend.utils.security import get_current_user_payload, parse_subject
+from backend.utils.http_cache import catalog_etag, etag_matches, not_modified, set_cache_headers
+from backend.utils.pagination import (
+    NEXT_CURSOR_HEADER, encode_cursor, decode_id_cursor, decode_time_id_cursor
+)
+from backend.utils.idempotency import (
+    idempotency_store, IDEMPOTENCY_KEY_HEADER, IDEMPOTENCY_KEY_MAX_LENGTH, IDEMPOTENT_REPLAY_HEADER
+)
 
 router = APIRouter(prefix="/order", tags=["Order"])
 
@@ -44,15 +51,19 @@ def get_current_user_id(payload: dict = Depends(get_current_user_payload)) -> in
 #   use_user_setting：可选，是否使用用户保存的过敏原设置（默认false）
 #   allergens：可选，临时指定的过敏原列表，逗号分隔，如 "milk,nuts,gluten"
 #   limit：可选，每页数量（默认 100）
-#   offset：可选，偏移量（默认 0）
+#   offset：可选，偏移量（默认 0，保留兼容；推荐使用 cursor）
+#   cursor：可选，游标（取上一页响应头 X-Next-Cursor 的值）
+# 响应头：X-Next-Cursor：本页已满时返回下一页游标
 # 权限：需要 Authorization（用户登录）
 @router.get("/menu", response_model=List[ProductOut])
 def browse_menu(
+    response: Response,
     categoryId: Optional[int] = Query(None),
     use_user_setting: bool = Query(False),
     allergens: Optional[str] = Query(None),  # 逗号分隔的过敏原列表
     limit: int = Query(100, ge=1, le=500),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None),
     user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db),
 ):
@@ -62,6 +73,11 @@ def browse_menu(
     - 如果提供了 allergens 参数，使用临时指定的过敏原（优先级高于用户设置）
     - 如果都没有，返回所有产品
     """
+    try:
+        after_id = decode_id_cursor(cursor, "product")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     exclude_allergens = []
 
     # 优先使用临时指定的过敏原
@@ -78,7 +94,8 @@ def browse_menu(
             exclude_allergens=exclude_allergens,
             category_id=categoryId,
             limit=limit,
-            offset=offset
+            offset=offset,
+            after_id=after_id
         )
     else:
         # 否则使用常规查询
@@ -86,9 +103,12 @@ def browse_menu(
             db,
             category_id=categoryId,
             limit=limit,
-            offset=offset
+            offset=offset,
+            after_id=after_id
         )
 
+    if len(products) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor("product", products[-1].id)
     return products
 
 
@@ -100,27 +120,27 @@ def browse_menu(
 # URL：GET /order/menu/products/{product_id}
 # 路径参数：
 #   product_id：产品 ID
+# 缓存：响应带 ETag（目录版本号）与 Cache-Control（private）；未变化时返回 304
 # 权限：需要 Authorization（用户登录）
 @router.get("/menu/products/{product_id}", response_model=ProductDetail)
 def get_product_detail(
     product_id: int,
+    request: Request,
+    response: Response,
     user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db)
 ):
     """获取产品详情，包括所有可选的modifier"""
-    product = catalog_crud.get_product(db, product_id)
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-
-    modifiers = catalog_crud.get_product_modifiers(db, product_id)
+    etag = catalog_etag()
+    if etag_matches(request, etag):
+        return not_modified(etag, public=False)
 
-    return {
-        "id": product.id,
-        "name": product.name,
-        "price": product.price,
-        "type_id": product.type_id,
-        "modifiers": modifiers
-    }
+    # 一次 JOIN 查询拿到产品和 modifiers（与 /catalog/products:batch 同一路径）
+    details = catalog_crud.get_products_with_modifiers(db, [product_id])
+    if not details:
+        raise HTTPException(status_code=404, detail="Product not found")
+    set_cache_headers(response, etag, public=False)
+    return details[0]
 
 
 # ====== 购物车相关接口 ======
@@ -135,35 +155,36 @@ def get_product_detail(
 #   {
 #     "product_id": 1,
 #     "quantity": 2,
-#     "modifiers": [1, 3, 5]  // modifier ID列表
+#     "modifiers": [1, 3, 5],  // modifier ID列表
+#     "merge": true  // 可选，默认 true：购物车里已有相同产品和 modifier 组合时直接加数量；false 时单独成一行
 #   }
+# 查询参数（可选）：
+#   with_total：为 true 时在返回的购物车项中附带 cart_total（购物车总价）
+# 返回：新加入（或合并后）的购物车项（已定价），不需要再请求整个购物车
 # 权限：需要 Authorization（用户登录）
-@router.post("/cart", response_model=CartItemOut)
+@router.post("/cart", response_model=CartItemWriteOut, response_model_exclude_none=True)
 def add_to_cart(
     request: AddToCartRequest,
+    with_total: bool = Query(False),
     user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db)
 ):
     """添加商品到购物车"""
     try:
-        cart_item = order_crud.add_to_cart(
+        item = order_crud.add_to_cart(
             db,
             user_id=user_id,
             product_id=request.product_id,
             quantity=request.quantity,
-            modifier_ids=request.modifiers
+            modifier_ids=request.modifiers,
+            merge=request.merge
         )
-
-        # 获取完整的购物车项详情
-        items = order_crud.get_cart_items_with_details(db, user_id)
-        for item in items:
-            if item["id"] == cart_item["id"]:
-                return CartItemOut(**item)
-
-        raise HTTPException(status_code=500, detail="Failed to retrieve cart item")
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+    cart_total = order_crud.get_cart_total(db, user_id) if with_total else None
+    return CartItemWriteOut(**item, cart_total=cart_total)
+
 
 # ---------------------------------------------------------
 # 获取购物车
@@ -178,15 +199,31 @@ def get_cart(
     db: Session = Depends(get_db)
 ):
     """获取购物车详情，包括所有商品、modifiers和总价"""
-    items = order_crud.get_cart_items_with_details(db, user_id)
-
-    # 计算总价
-    total_price = sum(item["item_subtotal"] for item in items)
+    # 总价和件数由购物车写操作增量维护，不需要在这里重新累加
+    items, total_price, item_count = order_crud.get_cart_with_totals(db, user_id)
 
     # 转换为响应模型
     cart_items = [CartItemOut(**item) for item in items]
 
-    return CartOut(items=cart_items, total_price=total_price)
+    return CartOut(items=cart_items, total_price=total_price, item_count=item_count)
+
+
+# ---------------------------------------------------------
+# 获取购物车摘要
+# ---------------------------------------------------------
+# 接口说明：
+# 功能：只返回购物车总价和商品件数（购物车面板轮询用），不展开购物车项
+#       读取的是写操作增量维护的值，开销与购物车大小无关
+# URL：GET /order/cart/summary
+# 权限：需要 Authorization（用户登录）
+@router.get("/cart/summary", response_model=CartSummaryOut)
+def get_cart_summary(
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    """获取购物车总价和件数"""
+    total_price, item_count = order_crud.get_cart_summary(db, user_id)
+    return CartSummaryOut(total_price=total_price, item_count=item_count)
 
 
 # ---------------------------------------------------------
@@ -202,34 +239,33 @@ def get_cart(
 #     "quantity": 3,  // 可选
 #     "modifiers": [2, 4]  // 可选，modifier ID列表
 #   }
+# 查询参数（可选）：
+#   with_total：为 true 时在返回的购物车项中附带 cart_total（购物车总价）
+# 返回：更新后的购物车项（已定价）
 # 权限：需要 Authorization（用户登录）
-@router.put("/cart/{cart_item_id}", response_model=CartItemOut)
+@router.put("/cart/{cart_item_id}", response_model=CartItemWriteOut, response_model_exclude_none=True)
 def update_cart_item(
     cart_item_id: str,
     request: UpdateCartItemRequest,
+    with_total: bool = Query(False),
     user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db)
 ):
     """更新购物车项的数量或modifiers"""
     try:
-        order_crud.update_cart_item(
+        item = order_crud.update_cart_item(
             db,
             cart_item_id=cart_item_id,
             user_id=user_id,
             quantity=request.quantity,
             modifier_ids=request.modifiers
         )
-
-        # 获取更新后的购物车项详情
-        items = order_crud.get_cart_items_with_details(db, user_id)
-        for item in items:
-            if item["id"] == cart_item_id:
-                return CartItemOut(**item)
-
-        raise HTTPException(status_code=404, detail="Cart item not found")
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+    cart_total = order_crud.get_cart_total(db, user_id) if with_total else None
+    return CartItemWriteOut(**item, cart_total=cart_total)
+
 
 # ---------------------------------------------------------
 # 从购物车移除商品
@@ -271,6 +307,33 @@ def clear_cart(
 
 # ====== 订单相关接口 ======
 
+def _order_out(order_detail: dict) -> OrderOut:
+    """订单详情 dict（order_crud 返回的格式）转换为响应模型"""
+    items = [
+        OrderItemOut(
+            id=item["id"],
+            product_id=item["product_id"],
+            product_name=item["product_name"],
+            quantity=item["quantity"],
+            modifiers=[OrderItemModifierOut(**mod) for mod in item["modifiers"]],
+            price=item["price"]
+        )
+        for item in order_detail["items"]
+    ]
+
+    return OrderOut(
+        id=order_detail["id"],
+        order_number=order_detail["order_number"],
+        user_id=order_detail["user_id"],
+        total_price=order_detail["total_price"],
+        order_status=order_detail["order_status"],
+        payment_method=order_detail["payment_method"],
+        dine_option=order_detail["dine_option"],
+        items=items,
+        created_at=order_detail["created_at"]
+    )
+
+
 # ---------------------------------------------------------
 # 创建订单（从购物车结算）
 # ---------------------------------------------------------
@@ -278,51 +341,63 @@ def clear_cart(
 # 功能：从购物车创建订单，将购物车中的所有商品转为订单，并清空购物车
 # URL：POST /order/checkout
 # 请求体格式（JSON）：{"payment_method": "cash", "dine_option": "take_out"}
+# 请求头：Idempotency-Key：可选，客户端生成的唯一值（最长 255），重试时带同一个值：
+#   已成功的请求直接返回第一次的响应（响应头 Idempotent-Replayed: true），不会重复下单；
+#   第一次请求还在执行时，重试会等待它的结果；同一个值用在不同的请求体上返回 422
 # 权限：需要 Authorization（用户登录）
 @router.post("/checkout", response_model=OrderOut)
 def checkout(
     request: CreateOrderRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(
+        None, alias=IDEMPOTENCY_KEY_HEADER, min_length=1, max_length=IDEMPOTENCY_KEY_MAX_LENGTH
+    ),
     user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db)
 ):
     """从购物车创建订单并结算"""
+    if idempotency_key is None:
+        return _checkout(db, user_id, request)
+
+    scope = f"checkout:{user_id}"
+    fingerprint = idempotency_store.fingerprint(request.model_dump())
     try:
-        order = order_crud.create_order_from_cart(
+        stored = idempotency_store.begin(scope, idempotency_key, fingerprint)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except TimeoutError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if stored is not None:
+        response.headers[IDEMPOTENT_REPLAY_HEADER] = "true"
+        return OrderOut(**stored)
+
+    try:
+        order_detail = _create_order(db, user_id, request)
+    except HTTPException:
+        # 校验失败（购物车为空等），没有写入任何数据：释放 key，重试可以重新执行
+        idempotency_store.release(scope, idempotency_key)
+        raise
+    # 其他异常不释放 key：无法确定订单是否已经提交，保留占位直到 IDEMPOTENCY_LOCK_SECONDS 后过期，
+    # 期间的重试返回 409 而不是再下一单
+    order_out = _order_out(order_detail)
+    idempotency_store.complete(scope, idempotency_key, fingerprint, order_out.model_dump(mode="json"))
+    return order_out
+
+
+def _checkout(db: Session, user_id: int, request: CreateOrderRequest) -> OrderOut:
+    return _order_out(_create_order(db, user_id, request))
+
+
+def _create_order(db: Session, user_id: int, request: CreateOrderRequest) -> dict:
+    try:
+        # 返回的订单详情直接来自结算过程中的数据，不再查询数据库
+        return order_crud.create_order_from_cart(
             db, user_id,
             payment_method=request.payment_method,
             dine_option=request.dine_option
         )
-
-        # 获取订单详情
-        order_detail = order_crud.get_order_with_details(db, order.id, user_id)
-        if not order_detail:
-            raise HTTPException(status_code=500, detail="Failed to retrieve order")
-
-        # 转换为响应模型
-        items = [
-            OrderItemOut(
-                id=item["id"],
-                product_id=item["product_id"],
-                product_name=item["product_name"],
-                quantity=item["quantity"],
-                modifiers=[OrderItemModifierOut(**mod) for mod in item["modifiers"]],
-                price=item["price"]
-            )
-            for item in order_detail["items"]
-        ]
-
-        return OrderOut(
-            id=order_detail["id"],
-            order_number=order_detail["order_number"],
-            user_id=order_detail["user_id"],
-            total_price=order_detail["total_price"],
-            order_status=order_detail["order_status"],
-            payment_method=order_detail["payment_method"],
-            dine_option=order_detail["dine_option"],
-            items=items,
-            created_at=order_detail["created_at"]
-        )
     except ValueError as e:
+        # create_order_from_cart 只在写入前抛 ValueError
         raise HTTPException(status_code=400, detail=str(e))
 
 
@@ -346,30 +421,7 @@ def get_order(
     if not order_detail:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    # 转换为响应模型
-    items = [
-        OrderItemOut(
-            id=item["id"],
-            product_id=item["product_id"],
-            product_name=item["product_name"],
-            quantity=item["quantity"],
-            modifiers=[OrderItemModifierOut(**mod) for mod in item["modifiers"]],
-            price=item["price"]
-        )
-        for item in order_detail["items"]
-    ]
-
-    return OrderOut(
-        id=order_detail["id"],
-        order_number=order_detail["order_number"],
-        user_id=order_detail["user_id"],
-        total_price=order_detail["total_price"],
-        order_status=order_detail["order_status"],
-        payment_method=order_detail["payment_method"],
-        dine_option=order_detail["dine_option"],
-        items=items,
-        created_at=order_detail["created_at"]
-    )
+    return _order_out(order_detail)
 
 
 # ---------------------------------------------------------
@@ -380,47 +432,47 @@ def get_order(
 # URL：GET /order/orders
 # 查询参数（Query Params）：
 #   limit：可选，每页数量（默认 50）
-#   offset：可选，偏移量（默认 0）
+#   offset：可选，偏移量（默认 0，保留兼容；推荐使用 cursor）
+#   cursor：可选，游标（取上一页响应头 X-Next-Cursor 的值）
+#   view：可选，full（默认，包含订单项）或 summary（只有订单号、总价、状态、日期，不读取订单项）
+#   fields：可选，逗号分隔的字段列表，只返回（并只查询）这些字段，优先于 view
+#           可选字段：id, order_number, user_id, total_price, order_status, payment_method, dine_option, items, created_at
+# 响应头：X-Next-Cursor：本页已满时返回下一页游标
 # 权限：需要 Authorization（用户登录）
-@router.get("/orders", response_model=List[OrderOut])
+@router.get("/orders", response_model=List[OrderListOut], response_model_exclude_unset=True)
 def list_orders(
+    response: Response,
     limit: int = Query(50, ge=1, le=200),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None),
+    view: str = Query("full", pattern="^(full|summary)$"),
+    fields: Optional[str] = Query(None),
     user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db)
 ):
     """获取用户的订单列表"""
-    orders = order_crud.list_user_orders(db, user_id, limit, offset)
+    try:
+        after = decode_time_id_cursor(cursor, "order")
+        selected = order_crud.resolve_order_fields(fields, view)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # 只查询选中的订单列；不需要订单项时不读取 order_items / products
+    columns = [f for f in selected if f != "items"]
+    orders = order_crud.list_user_orders(db, user_id, limit, offset, after=after, columns=columns)
+    if len(orders) == limit:
+        last = orders[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor("order", last.created_at, last.id)
+
+    # 一页订单的明细和产品名称批量读取（共两条查询，与订单数量无关）
+    items_by_order = order_crud.load_order_items(db, [o.id for o in orders]) if "items" in selected else None
 
-    # 为每个订单获取详情
     result = []
     for order in orders:
-        order_detail = order_crud.get_order_with_details(db, order.id, user_id)
-        if order_detail:
-            items = [
-                OrderItemOut(
-                    id=item["id"],
-                    product_id=item["product_id"],
-                    product_name=item["product_name"],
-                    quantity=item["quantity"],
-                    modifiers=[OrderItemModifierOut(**mod) for mod in item["modifiers"]],
-                    price=item["price"]
-                )
-                for item in order_detail["items"]
-            ]
-
-            result.append(OrderOut(
-                id=order_detail["id"],
-                order_number=order_detail["order_number"],
-                user_id=order_detail["user_id"],
-                total_price=order_detail["total_price"],
-                order_status=order_detail["order_status"],
-                payment_method=order_detail["payment_method"],
-                dine_option=order_detail["dine_option"],
-                items=items,
-                created_at=order_detail["created_at"]
-            ))
-
+        data = {f: getattr(order, f) for f in columns}
+        if items_by_order is not None:
+            data["items"] = items_by_order[order.id]
+        result.append(OrderListOut(**data))
     return result
 
 
@@ -66,5 +66,57 @@ class ProductQuery(BaseModel):
 class AttachModifierRequest(BaseModel):
     modifier_id: int
 
+# 声明式同步：给一个或多个产品设定「完整的」modifier 集合（多的删、少的补）
+class SyncModifiersRequest(BaseModel):
+    product_ids: List[int] = Field(min_length=1)
+    modifier_ids: List[int] = []
+
+class SyncModifiersResult(BaseModel):
+    attached: int
+    detached: int
+
 # 反向引用修复
 ProductDetail.model_rebuild()
+
+# ====== 批量导入 / 导出 ======
+# 所有实体都必须带 id：按主键 UPSERT，导出的结果可以原样再导入
+
+class CategoryImport(BaseModel):
+    id: int
+    name: str
+
+class ProductImport(BaseModel):
+    id: int
+    name: str
+    price: Decimal = Field(default=Decimal("0.00"), ge=0)
+    type_id: int
+
+class ModifierImport(BaseModel):
+    id: int
+    name: str
+    type: str
+    price: Decimal = Field(default=Decimal("0.00"), ge=0)
+    is_active: int = 1
+
+class ModifierLinkImport(BaseModel):
+    product_id: int
+    modifier_id: int
+
+class ProductAllergenImport(BaseModel):
+    product_id: int
+    allergen: str = Field(min_length=1, max_length=50)
+
+class CatalogBundle(BaseModel):
+    categories: List[CategoryImport] = []
+    products: List[ProductImport] = []
+    modifiers: List[ModifierImport] = []
+    links: List[ModifierLinkImport] = []
+    allergens: List[ProductAllergenImport] = []
+
+class CatalogImportResult(BaseModel):
+    categories: int
+    products: int
+    modifiers: int
+    links: int
+    allergens: int
+    version: int
@@ -22,6 +22,7 @@ class AddToCartRequest(BaseModel):
     product_id: int
     quantity: int = Field(default=1, ge=1)
     modifiers: List[int] = Field(default_factory=list)  # modifier_id列表
+    merge: bool = True  # 与购物车中相同配置的商品合并（加数量）；false 时总是单独成一行
 
 
 class UpdateCartItemRequest(BaseModel):
@@ -42,15 +43,29 @@ class CartItemOut(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class CartItemWriteOut(CartItemOut):
+    """添加/更新购物车项的输出：被修改的那一行，可选带上购物车总价"""
+    cart_total: Optional[Decimal] = None  # 仅在请求 with_total=true 时返回
+
+
 class CartOut(BaseModel):
     """购物车输出"""
     items: List[CartItemOut]
     total_price: Decimal  # 购物车总价
+    item_count: int = 0  # 商品件数（所有项的 quantity 之和）
 
     class Config:
         from_attributes = True
 
 
+class CartSummaryOut(BaseModel):
+    """购物车摘要（只有总价和件数，供购物车角标/面板轮询）"""
+    total_price: Decimal
+    item_count: int
+
+
 # ====== 订单相关 ======
 
 class OrderItemModifierOut(BaseModel):
@@ -93,6 +108,19 @@ class OrderOut(BaseModel):
         from_attributes = True
 
 
+class OrderListOut(BaseModel):
+    """订单列表项：字段与 OrderOut 相同，按 view / fields 只返回选中的字段"""
+    id: Optional[int] = None
+    order_number: Optional[str] = None
+    user_id: Optional[int] = None
+    total_price: Optional[Decimal] = None
+    order_status: Optional[str] = None
+    payment_method: Optional[str] = None
+    dine_option: Optional[str] = None
+    items: Optional[List[OrderItemOut]] = None
+    created_at: Optional[datetime] = None
+
+
 class CreateOrderRequest(BaseModel):
     """创建订单请求（从购物车结算）"""
     payment_method: str = 'cash'  # cash, card, wechat
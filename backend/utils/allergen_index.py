@@ -0,0 +1,43 @@
+"""
+Allergen bitmask index
+过敏原位图索引：
+- 每种过敏原分配一个 bit，每个产品存一个掩码（包含的过敏原按位或）
+- 排除过敏原 = 先把要排除的过敏原合成一个掩码，再对整份目录的掩码数组做一次按位与
+- 随目录快照一起构建，product_allergens 变化（目录版本号 bump）时整体重建
+"""
+from functools import reduce
+from itertools import compress
+from operator import or_
+from typing import Dict, Iterable, Iterator, Mapping, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class AllergenIndex:
+    def __init__(self, product_allergens: Mapping[int, Iterable[str]]):
+        names = sorted({a.lower() for allergens in product_allergens.values() for a in allergens})
+        # 过敏原名称（小写） -> bit
+        self.bits: Dict[str, int] = {name: 1 << i for i, name in enumerate(names)}
+        # product_id -> 掩码；没有过敏原的产品不存（视为 0）
+        self.masks_by_id: Dict[int, int] = {
+            product_id: self.mask_for(allergens)
+            for product_id, allergens in product_allergens.items()
+        }
+
+    def mask_for(self, allergens: Iterable[str]) -> int:
+        """把过敏原名称列表合成掩码；目录里不存在的过敏原不会排除任何产品"""
+        return reduce(or_, (self.bits.get(a.lower(), 0) for a in allergens), 0)
+
+    def mask_of(self, product_id: int) -> int:
+        return self.masks_by_id.get(product_id, 0)
+
+    def masks(self, product_ids: Iterable[int]) -> Tuple[int, ...]:
+        """按给定顺序生成掩码数组（与产品列表一一对应）"""
+        return tuple(self.masks_by_id.get(pid, 0) for pid in product_ids)
+
+    @staticmethod
+    def exclude(rows: Iterable[T], masks: Iterable[int], exclude_mask: int) -> Iterator[T]:
+        """rows 与 masks 一一对应，惰性地保留与 exclude_mask 无交集的行"""
+        if not exclude_mask:
+            return iter(rows)
+        return compress(rows, (not mask & exclude_mask for mask in masks))
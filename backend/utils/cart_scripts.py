@@ -0,0 +1,260 @@
+"""
+Redis Lua scripts for cart mutations
+购物车的写操作（添加、修改数量/modifiers、删除、重新定价、清空）都用注册好的 Lua 脚本完成：
+- 每个操作一次往返（EVALSHA），并且在 Redis 端原子执行，kiosk 和手机同时改同一个购物车也不会互相覆盖
+- 总价和件数随每次写操作增量维护，读取时 O(1)
+- 添加与已有行配置相同的商品时合并到已有行（可按请求关闭）
+- 应用启动时 SCRIPT LOAD 一次；Redis 重启/脚本缓存被清空时，redis-py 的 Script 收到 NOSCRIPT
+  会自动重新加载并重试
+"""
+from typing import List, Optional
+
+import redis
+
+from backend.database import redis_client
+
+# 购物车 hash 中以 "_" 开头的是保留字段（cart_item_id 以时间戳开头，不会冲突）：
+#   _subtotal：所有行小计之和（分）
+#   _count：商品件数（所有行 quantity 之和）
+#   _v：上面的价格来自哪个目录版本；空串表示已过期（混入了不同版本的价格），读取时需要整体重新定价
+# 每行额外保存价格/名称快照（v、name、price、mods）以及 base_cents（产品单价）、
+# unit_cents（产品 + modifiers 单价）、subtotal_cents（行小计），写操作据此在脚本中增量维护 _subtotal / _count。
+# 另有一个索引 hash（KEYS[2]）：规范化的行配置 "product_id:排序后的modifier_ids" -> cart_item_id，
+# 添加相同配置时直接给已有行加数量，而不是新建一行。
+PRELUDE = """
+local RESERVED = {'_subtotal', '_count', '_v'}
+
+local function line_count(key)
+  local n = redis.call('HLEN', key)
+  for _, value in ipairs(redis.call('HMGET', key, unpack(RESERVED))) do
+    if value then
+      n = n - 1
+    end
+  end
+  return n
+end
+
+-- 本次写入的价格来自 version：空购物车直接采用该版本；与已有版本不一致时把总价标记为过期
+local function touch_version(key, version)
+  if line_count(key) == 0 then
+    redis.call('HSET', key, '_subtotal', 0, '_count', 0, '_v', version)
+  elseif redis.call('HGET', key, '_v') ~= version then
+    redis.call('HSET', key, '_v', '')
+  end
+end
+
+-- 行配置的规范化 key：product_id + 排序后的 modifier_ids
+local function canonical_key(line)
+  local ids = {}
+  for i, modifier_id in ipairs(line['modifiers'] or {}) do
+    ids[i] = modifier_id
+  end
+  table.sort(ids)
+  return line['product_id'] .. ':' .. table.concat(ids, ',')
+end
+
+-- 行被删除或配置改变时，移除指向它的索引项；返回它之前是否被索引
+local function unindex(index_key, line, cart_item_id)
+  local key = canonical_key(line)
+  if redis.call('HGET', index_key, key) == cart_item_id then
+    redis.call('HDEL', index_key, key)
+    return true
+  end
+  return false
+end
+"""
+
+# KEYS[1] = 购物车 hash, KEYS[2] = 行配置索引 hash
+# ARGV[1] = cart_item_id, ARGV[2] = 编码后的行, ARGV[3] = TTL（秒）
+# ARGV[4] = 定价的目录版本, ARGV[5] = 行小计（分）, ARGV[6] = 数量
+# ARGV[7] = '1' 时与相同配置的已有行合并（只加数量），'0' 时总是新建一行（且不参与之后的合并）
+# ARGV[8] = updated_at（合并时写入已有行）
+# 返回最终写入的行（新行或合并后的已有行）
+ADD_LINE = PRELUDE + """
+local line = cjson.decode(ARGV[2])
+local key = canonical_key(line)
+if ARGV[7] == '1' then
+  local existing_id = redis.call('HGET', KEYS[2], key)
+  local raw = existing_id and redis.call('HGET', KEYS[1], existing_id)
+  if raw then
+    local existing = cjson.decode(raw)
+    local quantity = tonumber(ARGV[6])
+    local unit = tonumber(existing['unit_cents'])
+    existing['quantity'] = existing['quantity'] + quantity
+    -- 已有行按它自己的单价累加，行内快照和总价的版本关系不变
+    if unit and existing['subtotal_cents'] then
+      existing['subtotal_cents'] = existing['subtotal_cents'] + unit * quantity
+      redis.call('HINCRBY', KEYS[1], '_subtotal', unit * quantity)
+    else
+      existing['subtotal_cents'] = nil
+      redis.call('HSET', KEYS[1], '_v', '')
+    end
+    redis.call('HINCRBY', KEYS[1], '_count', quantity)
+    existing['updated_at'] = ARGV[8]
+    local encoded = cjson.encode(existing)
+    redis.call('HSET', KEYS[1], existing_id, encoded)
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    return encoded
+  end
+end
+touch_version(KEYS[1], ARGV[4])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('HINCRBY', KEYS[1], '_subtotal', ARGV[5])
+redis.call('HINCRBY', KEYS[1], '_count', ARGV[6])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+if ARGV[7] == '1' then
+  redis.call('HSET', KEYS[2], key, ARGV[1])
+  redis.call('EXPIRE', KEYS[2], ARGV[3])
+end
+return ARGV[2]
+"""
+
+# KEYS[1] = 购物车 hash, KEYS[2] = 行配置索引 hash
+# ARGV[1] = cart_item_id, ARGV[2] = 新数量（空串表示不改）, ARGV[3] = 新 modifiers JSON（空串表示不改）
+# ARGV[4] = updated_at, ARGV[5] = TTL（秒）
+# ARGV[6] = 新 modifiers 的单价之和（分，只在改 modifiers 时使用）, ARGV[7] = 定价的目录版本
+# ARGV[8] = 新 modifiers 的明细快照 JSON（只在改 modifiers 时使用）
+# 返回更新后的行；行不存在时返回 nil
+UPDATE_LINE = PRELUDE + """
+local raw = redis.call('HGET', KEYS[1], ARGV[1])
+if not raw then
+  return nil
+end
+local line = cjson.decode(raw)
+local old_subtotal = tonumber(line['subtotal_cents'])
+local old_quantity = tonumber(line['quantity']) or 0
+if ARGV[3] ~= '' then
+  local indexed = unindex(KEYS[2], line, ARGV[1])
+  line['modifiers'] = cjson.decode(ARGV[3])
+  line['mods'] = cjson.decode(ARGV[8])
+  -- 新配置还没有对应的行时，让之后的相同添加合并到这一行
+  if indexed then
+    redis.call('HSETNX', KEYS[2], canonical_key(line), ARGV[1])
+    redis.call('EXPIRE', KEYS[2], ARGV[5])
+  end
+  touch_version(KEYS[1], ARGV[7])
+  -- 行内快照的产品部分来自 v 版本，modifier 部分来自 ARGV[7] 版本：不一致时把行标记为过期
+  if line['v'] ~= ARGV[7] then
+    line['v'] = ''
+  end
+  local base = tonumber(line['base_cents'])
+  line['unit_cents'] = base and (base + tonumber(ARGV[6])) or nil
+end
+if ARGV[2] ~= '' then
+  line['quantity'] = tonumber(ARGV[2])
+end
+local unit = tonumber(line['unit_cents'])
+if unit and old_subtotal then
+  line['subtotal_cents'] = unit * line['quantity']
+  redis.call('HINCRBY', KEYS[1], '_subtotal', line['subtotal_cents'] - old_subtotal)
+else
+  -- 旧数据没有价格字段，无法增量计算：标记过期，读取时重新定价
+  line['subtotal_cents'] = nil
+  redis.call('HSET', KEYS[1], '_v', '')
+end
+redis.call('HINCRBY', KEYS[1], '_count', line['quantity'] - old_quantity)
+line['updated_at'] = ARGV[4]
+local encoded = cjson.encode(line)
+redis.call('HSET', KEYS[1], ARGV[1], encoded)
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return encoded
+"""
+
+# KEYS[1] = 购物车 hash, KEYS[2] = 行配置索引 hash
+# ARGV[1] = cart_item_id；返回删除的行数
+REMOVE_LINE = PRELUDE + """
+local raw = redis.call('HGET', KEYS[1], ARGV[1])
+if not raw then
+  return 0
+end
+local line = cjson.decode(raw)
+redis.call('HDEL', KEYS[1], ARGV[1])
+unindex(KEYS[2], line, ARGV[1])
+local subtotal = tonumber(line['subtotal_cents'])
+if subtotal then
+  redis.call('HINCRBY', KEYS[1], '_subtotal', -subtotal)
+else
+  redis.call('HSET', KEYS[1], '_v', '')
+end
+redis.call('HINCRBY', KEYS[1], '_count', -(tonumber(line['quantity']) or 0))
+return 1
+"""
+
+# KEYS[1] = 购物车 hash, KEYS[2] = 行配置索引 hash
+# ARGV[1] = 定价的目录版本
+# ARGV[2] = JSON：{"set": [[cart_item_id, 读取到的原值, 重新定价后的值], ...], "drop": [要删除的 cart_item_id, ...]}
+# 只有原值没被并发修改的行才会写回；最后从所有行重新汇总 _subtotal / _count，
+# 只有每一行都按该版本定过价时才把 _v 设为该版本
+REPRICE_CART = PRELUDE + """
+local version = ARGV[1]
+local changes = cjson.decode(ARGV[2])
+local repriced = {}
+for _, cart_item_id in ipairs(changes['drop']) do
+  local raw = redis.call('HGET', KEYS[1], cart_item_id)
+  if raw then
+    redis.call('HDEL', KEYS[1], cart_item_id)
+    unindex(KEYS[2], cjson.decode(raw), cart_item_id)
+  end
+end
+for _, change in ipairs(changes['set']) do
+  if redis.call('HGET', KEYS[1], change[1]) == change[2] then
+    redis.call('HSET', KEYS[1], change[1], change[3])
+    repriced[change[1]] = true
+  end
+end
+local all = redis.call('HGETALL', KEYS[1])
+local subtotal, count, complete = 0, 0, true
+for i = 1, #all, 2 do
+  if string.sub(all[i], 1, 1) ~= '_' then
+    if not repriced[all[i]] then
+      complete = false
+    end
+    local line = cjson.decode(all[i + 1])
+    subtotal = subtotal + (tonumber(line['subtotal_cents']) or 0)
+    count = count + (tonumber(line['quantity']) or 0)
+  end
+end
+redis.call('HSET', KEYS[1], '_subtotal', subtotal, '_count', count, '_v', complete and version or '')
+return {subtotal, count, complete and 1 or 0}
+"""
+
+# KEYS[1] = 购物车 hash, KEYS[2] = 行配置索引 hash, KEYS[3] = 旧布局的购物车项ID集合
+# ARGV[1] = 旧布局单项 key 的前缀（拼上 cart_item_id）
+# 旧布局的单项 key 由集合成员推出，无法预先声明（项目只用单实例 Redis，不涉及 cluster 槽位）
+CLEAR_CART = """
+local legacy = redis.call('SMEMBERS', KEYS[3])
+for _, cart_item_id in ipairs(legacy) do
+  redis.call('DEL', ARGV[1] .. cart_item_id)
+end
+return redis.call('DEL', KEYS[1], KEYS[2], KEYS[3])
+"""
+
+
+class CartScripts:
+    def __init__(self, client: redis.Redis = redis_client):
+        self.client = client
+        self.add_line = client.register_script(ADD_LINE)
+        self.update_line = client.register_script(UPDATE_LINE)
+        self.remove_line = client.register_script(REMOVE_LINE)
+        self.reprice_cart = client.register_script(REPRICE_CART)
+        self.clear_cart = client.register_script(CLEAR_CART)
+
+    def all(self) -> List:
+        return [self.add_line, self.update_line, self.remove_line, self.reprice_cart, self.clear_cart]
+
+    def load(self) -> None:
+        """启动时把所有脚本 SCRIPT LOAD 到 Redis；失败也不影响启动（调用时会自动加载）"""
+        try:
+            for script in self.all():
+                script.sha = self.client.script_load(script.script)
+        except redis.RedisError as e:
+            print(f"购物车 Lua 脚本预加载失败，将在首次调用时加载: {e}")
+
+    def run(self, script, keys: List[str], args: List) -> Optional[object]:
+        # 显式传 client：redis-py 在 NOSCRIPT 时会用它重新 SCRIPT LOAD 再 EVALSHA
+        return script(keys=keys, args=args, client=self.client)
+
+
+# 创建全局实例
+cart_scripts = CartScripts()
@@ -0,0 +1,1048 @@
+"""
+Cart storage backends
+购物车存储层：order_crud 负责校验和定价，这里只负责「行」的存取，三种实现语义一致：
+- RedisCartStore：线上默认。每个用户一个 hash，写操作是 Lua 脚本（见 cart_scripts.py），
+  总价/件数增量维护，2 小时 TTL
+- MemoryCartStore：进程内 dict，单机测试 / 压测用，不需要 Redis（不过期，重启即丢）
+- SQLCartStore：carts / cart_items / cart_item_modifiers 三张表，持久化；
+  表里没有价格快照和总价字段，所以读取时总是按目录快照重新定价
+- FailoverCartStore：Redis 为主、SQL 为后备（Redis 故障切换 + 可选的定期写回）
+通过 CART_STORE_BACKEND（redis / memory / sql）选择；redis 默认带 SQL 后备（CART_SQL_FALLBACK）。
+
+一行（line）是一个 dict：
+  id、product_id、quantity、modifiers（modifier_id 列表）、created_at / updated_at，
+  以及 order_crud 写入的价格/名称快照：v（目录版本）、name、price、mods、base_cents、unit_cents、subtotal_cents
+"""
+import copy
+import dataclasses
+from abc import ABC, abstractmethod
+import json
+import secrets
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import redis
+from sqlalchemy import select, delete, update, func
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from backend.config import (
+    CART_STORE_BACKEND, CART_SQL_FALLBACK, CART_REDIS_RETRY_SECONDS, CART_WRITE_BEHIND_SECONDS
+)
+from backend.database import redis_client, SessionLocal
+from backend.models.order import Cart, CartItem, CartItemModifier
+from backend.utils.cart_scripts import cart_scripts, CartScripts
+
+CART_TTL_SECONDS = 7200  # 购物车 2 小时过期（Redis）
+CART_RESERVED_PREFIX = "_"
+# 写回开启时的哨兵 key：它不存在说明 Redis 是空的（首次启动或丢数据重启），需要从 SQL 恢复购物车
+CART_PERSISTED_SENTINEL_KEY = "cart:persisted"
+# Redis 恢复后把 SQL 中的行合并回 Redis 时的互斥锁（多个 worker 只有一个在合并）
+CART_RECONCILE_LOCK_KEY = "cart:reconcile:lock"
+CART_RECONCILE_LOCK_SECONDS = 60
+CART_WRITE_BEHIND_BATCH_SIZE = 200
+# 视为「Redis 不可用」的错误；脚本错误等其他 RedisError 照常抛出
+REDIS_OUTAGE_ERRORS = (redis.ConnectionError, redis.TimeoutError, OSError)
+# redis-py 建立连接失败时的错误信息（连接被拒绝、连接超时、连接池没有空闲连接）
+REDIS_CONNECT_ERROR_MARKERS = ("connecting to", "No connection available")
+
+
+def _failed_before_send(error: Exception) -> bool:
+    """
+    错误是否发生在命令发出之前。命令发出之后的超时或断开不能说明脚本没有执行
+    （可能已经在 Redis 上执行、只是没收到回复），这样的写入不能再在 SQL 上做一次
+    """
+    message = str(error)
+    return any(marker in message for marker in REDIS_CONNECT_ERROR_MARKERS)
+
+
+@dataclass
+class CartTotals:
+    subtotal_cents: int
+    count: int
+    # 总价对应的目录版本；None / 空串表示需要重新定价
+    version: Optional[str]
+
+
+@dataclass
+class CartState:
+    """一次读取得到的整个购物车"""
+    lines: Dict[str, Dict[str, Any]]  # cart_item_id -> 行，按加入顺序
+    totals: CartTotals
+    # 各实现自用的比较基准（重新定价时只写回没被并发修改的行）
+    token: Any = field(default=None, repr=False)
+
+
+def canonical_line_key(line: Dict[str, Any]) -> str:
+    """行配置的规范化 key：product_id + 排序后的 modifier_ids（与 cart_scripts 中的 canonical_key 相同）"""
+    return f"{line['product_id']}:{','.join(str(m) for m in sorted(line.get('modifiers') or []))}"
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+class CartStore(ABC):
+    """购物车存储接口"""
+
+    def warm_up(self) -> None:
+        """应用启动时调用（预加载脚本、启动后台线程等），默认什么都不做"""
+
+    def shutdown(self) -> None:
+        """应用退出时调用，默认什么都不做"""
+
+    @abstractmethod
+    def load(self, user_id: int) -> CartState:
+        """读出整个购物车"""
+
+    @abstractmethod
+    def totals(self, user_id: int) -> Optional[CartTotals]:
+        """只读总价/件数（O(1)）；实现不维护总价时返回 None"""
+
+    @abstractmethod
+    def get_product_id(self, user_id: int, cart_item_id: str) -> Optional[int]:
+        """行的 product_id；行不存在时返回 None"""
+
+    @abstractmethod
+    def add_line(self, user_id: int, line: Dict[str, Any], version: str, merge: bool) -> Dict[str, Any]:
+        """
+        写入新行（line 中已带价格快照，价格来自 version）。
+        merge=True 且已有相同配置的行时，改为给已有行加数量；返回最终写入的行
+        """
+
+    @abstractmethod
+    def update_line(
+        self,
+        user_id: int,
+        cart_item_id: str,
+        quantity: Optional[int],
+        modifier_ids: Optional[List[int]],
+        mods: List[list],
+        mods_cents: int,
+        version: str,
+    ) -> Optional[Dict[str, Any]]:
+        """修改数量和/或 modifiers（mods / mods_cents 是新 modifiers 的明细快照和单价之和）；行不存在时返回 None"""
+
+    @abstractmethod
+    def remove_line(self, user_id: int, cart_item_id: str) -> bool:
+        """删除一行；返回是否删除了"""
+
+    @abstractmethod
+    def reprice(
+        self,
+        user_id: int,
+        state: CartState,
+        version: str,
+        lines: Dict[str, Dict[str, Any]],
+        drop_ids: List[str],
+    ) -> Tuple[int, int]:
+        """写回重新定价后的行、删除 drop_ids，返回重新汇总的 (总价（分）, 件数)"""
+
+    @abstractmethod
+    def clear(self, user_id: int) -> None:
+        """清空购物车"""
+
+    @abstractmethod
+    def replace(self, user_id: int, lines: List[Dict[str, Any]]) -> None:
+        """用给定的行整体替换购物车（在不同存储之间搬运购物车时使用）"""
+
+
+def _sum_lines(lines: Dict[str, Dict[str, Any]]) -> Tuple[int, int]:
+    return (
+        sum(line.get("subtotal_cents") or 0 for line in lines.values()),
+        sum(line["quantity"] for line in lines.values()),
+    )
+
+
+def _line_order(line: Dict[str, Any]) -> Tuple[str, str]:
+    """按加入购物车的先后排序（各实现的 cart_item_id 格式不同，先按 created_at）"""
+    return line.get("created_at") or "", str(line["id"])
+
+
+# ====== Redis ======
+
+class RedisCartStore(CartStore):
+    """
+    存储布局：每个用户一个 hash，field = cart_item_id，value = 编码后的行（JSON），
+    以 "_" 开头的保留字段存放总价/件数及其目录版本；另有一个 hash 作为行配置索引（合并相同配置的行）。
+    旧布局（cart:user:{id} 集合 + 每项一个 string key）在读取时惰性迁移到新布局。
+    """
+
+    def __init__(self, client: redis.Redis = redis_client, scripts: CartScripts = cart_scripts,
+                 ttl: int = CART_TTL_SECONDS):
+        self.client = client
+        self.scripts = scripts
+        self.ttl = ttl
+
+    # ---- keys ----
+
+    @staticmethod
+    def cart_key(user_id: int) -> str:
+        """获取购物车的Redis key（hash）"""
+        return f"cart:user:{user_id}:lines"
+
+    @staticmethod
+    def index_key(user_id: int) -> str:
+        """行配置索引（hash）：product_id + 排序后的 modifier_ids -> cart_item_id"""
+        return f"cart:user:{user_id}:keys"
+
+    @staticmethod
+    def legacy_cart_key(user_id: int) -> str:
+        """旧布局：购物车项ID集合"""
+        return f"cart:user:{user_id}"
+
+    @staticmethod
+    def legacy_item_key(user_id: int, cart_item_id: str) -> str:
+        """旧布局：单个购物车项的string key"""
+        return f"cart:user:{user_id}:item:{cart_item_id}"
+
+    def _keys(self, user_id: int) -> List[str]:
+        """购物车脚本的 KEYS：[购物车 hash, 行配置索引]"""
+        return [self.cart_key(user_id), self.index_key(user_id)]
+
+    # ---- 编解码 / 旧布局迁移 ----
+
+    @staticmethod
+    def encode(line: Dict[str, Any]) -> str:
+        return json.dumps(line, separators=(",", ":"))
+
+    @staticmethod
+    def decode(raw: str) -> Dict[str, Any]:
+        line = json.loads(raw)
+        # Lua 的 cjson 会把空数组编码成 {}，这里统一还原成列表
+        line["modifiers"] = list(line.get("modifiers") or [])
+        if "mods" in line:
+            line["mods"] = list(line["mods"] or [])
+        return line
+
+    def _migrate_legacy(self, user_id: int) -> Dict[str, str]:
+        """把旧布局的购物车搬到 hash 中，返回搬过来的 {cart_item_id: 编码后的行}"""
+        legacy_key = self.legacy_cart_key(user_id)
+        cart_item_ids = list(self.client.smembers(legacy_key))
+        item_keys = [self.legacy_item_key(user_id, cid) for cid in cart_item_ids]
+        raws = self.client.mget(item_keys) if item_keys else []
+        lines = {cid: raw for cid, raw in zip(cart_item_ids, raws) if raw}
+
+        pipe = self.client.pipeline(transaction=True)
+        if lines:
+            pipe.hset(self.cart_key(user_id), mapping=lines)
+            pipe.expire(self.cart_key(user_id), self.ttl)
+        pipe.delete(legacy_key, *item_keys)
+        pipe.execute()
+        return lines
+
+    def _run_with_migration(self, user_id: int, script, args: List) -> Any:
+        """
+        对购物车 hash 执行一个脚本；目标行不在 hash 中（脚本返回空）时，
+        说明它可能还在旧布局里：迁移一次后重试
+        """
+        keys = self._keys(user_id)
+        result = self.scripts.run(script, keys, args)
+        if not result and self._migrate_legacy(user_id):
+            result = self.scripts.run(script, keys, args)
+        return result
+
+    # ---- CartStore ----
+
+    def warm_up(self) -> None:
+        # 预加载购物车 Lua 脚本（之后的写操作都走 EVALSHA）
+        self.scripts.load()
+
+    def load(self, user_id: int) -> CartState:
+        # 一次往返读出整个购物车（顺带检查是否还有旧布局的数据需要迁移）
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hgetall(self.cart_key(user_id))
+        pipe.exists(self.legacy_cart_key(user_id))
+        fields, has_legacy = pipe.execute()
+        if has_legacy:
+            fields.update(self._migrate_legacy(user_id))
+        raw_lines, meta = {}, {}
+        for name, value in fields.items():
+            (meta if name.startswith(CART_RESERVED_PREFIX) else raw_lines)[name] = value
+        decoded = sorted((self.decode(raw) for raw in raw_lines.values()), key=_line_order)
+        lines = {line["id"]: line for line in decoded}
+        totals = CartTotals(int(meta.get("_subtotal", 0)), int(meta.get("_count", 0)), meta.get("_v"))
+        return CartState(lines, totals, token=raw_lines)
+
+    def totals(self, user_id: int) -> Optional[CartTotals]:
+        subtotal, count, version = self.client.hmget(self.cart_key(user_id), "_subtotal", "_count", "_v")
+        if subtotal is None or count is None:
+            return None
+        return CartTotals(int(subtotal), int(count), version)
+
+    def get_product_id(self, user_id: int, cart_item_id: str) -> Optional[int]:
+        raw = self.client.hget(self.cart_key(user_id), cart_item_id)
+        if raw is None:
+            raw = self._migrate_legacy(user_id).get(cart_item_id)
+        return self.decode(raw)["product_id"] if raw else None
+
+    def add_line(self, user_id: int, line: Dict[str, Any], version: str, merge: bool) -> Dict[str, Any]:
+        # Lua：合并或 HSET + 累加总价/件数 + EXPIRE，一次往返
+        raw = self.scripts.run(self.scripts.add_line, self._keys(user_id), [
+            line["id"], self.encode(line), self.ttl,
+            version, line["subtotal_cents"], line["quantity"],
+            1 if merge else 0, _now()
+        ])
+        return self.decode(raw)
+
+    def update_line(self, user_id, cart_item_id, quantity, modifier_ids, mods, mods_cents, version):
+        # 读取、修改、写回（连同总价/件数的增量）在 Lua 中原子完成；行不存在时脚本返回空
+        raw = self._run_with_migration(user_id, self.scripts.update_line, [
+            cart_item_id,
+            "" if quantity is None else quantity,
+            "" if modifier_ids is None else json.dumps(modifier_ids),
+            _now(),
+            self.ttl,
+            "" if modifier_ids is None else mods_cents,
+            version,
+            "" if modifier_ids is None else json.dumps(mods)
+        ])
+        return self.decode(raw) if raw else None
+
+    def remove_line(self, user_id: int, cart_item_id: str) -> bool:
+        return bool(self._run_with_migration(user_id, self.scripts.remove_line, [cart_item_id]))
+
+    def reprice(self, user_id, state, version, lines, drop_ids):
+        changes = {
+            "set": [[cid, state.token[cid], self.encode(line)] for cid, line in lines.items()],
+            "drop": drop_ids
+        }
+        subtotal, count, _ = self.scripts.run(
+            self.scripts.reprice_cart,
+            self._keys(user_id),
+            [version, json.dumps(changes, separators=(",", ":"))]
+        )
+        return int(subtotal), int(count)
+
+    def clear(self, user_id: int) -> None:
+        # 连同旧布局的 key 一起，在一个脚本中删除
+        self.scripts.run(
+            self.scripts.clear_cart,
+            self._keys(user_id) + [self.legacy_cart_key(user_id)],
+            [self.legacy_item_key(user_id, "")]
+        )
+
+    def replace(self, user_id: int, lines: List[Dict[str, Any]]) -> None:
+        # 不写总价字段：下次读取时按目录快照重新定价并汇总
+        cart_key, index_key = self._keys(user_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(cart_key, index_key)
+        if lines:
+            pipe.hset(cart_key, mapping={line["id"]: self.encode(line) for line in lines})
+            index = {}
+            for line in lines:
+                index.setdefault(canonical_line_key(line), line["id"])
+            pipe.hset(index_key, mapping=index)
+            pipe.expire(cart_key, self.ttl)
+            pipe.expire(index_key, self.ttl)
+        pipe.execute()
+
+
+# ====== 进程内 dict ======
+
+class MemoryCartStore(CartStore):
+    """
+    语义与 RedisCartStore（cart_scripts 中的 Lua 脚本）逐条对应，整个 store 一把锁保证原子性。
+    读写都复制行，调用方拿到的 dict 不会与存储共享。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._carts: Dict[int, Dict[str, Any]] = {}
+
+    def _cart(self, user_id: int) -> Dict[str, Any]:
+        cart = self._carts.get(user_id)
+        if cart is None:
+            cart = self._carts[user_id] = {"lines": {}, "index": {}, "subtotal": 0, "count": 0, "v": None}
+        return cart
+
+    @staticmethod
+    def _touch_version(cart: Dict[str, Any], version: str) -> None:
+        if not cart["lines"]:
+            cart.update(subtotal=0, count=0, v=version)
+        elif cart["v"] != version:
+            cart["v"] = ""
+
+    @staticmethod
+    def _unindex(cart: Dict[str, Any], line: Dict[str, Any], cart_item_id: str) -> bool:
+        key = canonical_line_key(line)
+        if cart["index"].get(key) == cart_item_id:
+            del cart["index"][key]
+            return True
+        return False
+
+    def load(self, user_id: int) -> CartState:
+        with self._lock:
+            cart = self._carts.get(user_id)
+            if cart is None:
+                return CartState({}, CartTotals(0, 0, None), token={})
+            lines = copy.deepcopy(cart["lines"])
+            totals = CartTotals(cart["subtotal"], cart["count"], cart["v"])
+        return CartState(lines, totals, token=copy.deepcopy(lines))
+
+    def totals(self, user_id: int) -> Optional[CartTotals]:
+        with self._lock:
+            cart = self._carts.get(user_id)
+            return CartTotals(cart["subtotal"], cart["count"], cart["v"]) if cart else None
+
+    def get_product_id(self, user_id: int, cart_item_id: str) -> Optional[int]:
+        with self._lock:
+            line = self._carts.get(user_id, {}).get("lines", {}).get(cart_item_id)
+            return line["product_id"] if line else None
+
+    def add_line(self, user_id, line, version, merge):
+        line = copy.deepcopy(line)
+        key = canonical_line_key(line)
+        with self._lock:
+            cart = self._cart(user_id)
+            existing = cart["lines"].get(cart["index"].get(key)) if merge else None
+            if existing is not None:
+                # 已有行按它自己的单价累加
+                quantity = line["quantity"]
+                existing["quantity"] += quantity
+                if existing.get("unit_cents") is not None and existing.get("subtotal_cents") is not None:
+                    existing["subtotal_cents"] += existing["unit_cents"] * quantity
+                    cart["subtotal"] += existing["unit_cents"] * quantity
+                else:
+                    existing.pop("subtotal_cents", None)
+                    cart["v"] = ""
+                cart["count"] += quantity
+                existing["updated_at"] = _now()
+                return copy.deepcopy(existing)
+
+            self._touch_version(cart, version)
+            cart["lines"][line["id"]] = line
+            cart["subtotal"] += line["subtotal_cents"]
+            cart["count"] += line["quantity"]
+            if merge:
+                cart["index"][key] = line["id"]
+            return copy.deepcopy(line)
+
+    def update_line(self, user_id, cart_item_id, quantity, modifier_ids, mods, mods_cents, version):
+        with self._lock:
+            cart = self._carts.get(user_id)
+            line = cart["lines"].get(cart_item_id) if cart else None
+            if line is None:
+                return None
+            old_subtotal = line.get("subtotal_cents")
+            old_quantity = line["quantity"]
+            if modifier_ids is not None:
+                indexed = self._unindex(cart, line, cart_item_id)
+                line["modifiers"] = list(modifier_ids)
+                line["mods"] = copy.deepcopy(mods)
+                if indexed:
+                    cart["index"].setdefault(canonical_line_key(line), cart_item_id)
+                self._touch_version(cart, version)
+                if line.get("v") != version:
+                    line["v"] = ""
+                if line.get("base_cents") is not None:
+                    line["unit_cents"] = line["base_cents"] + mods_cents
+                else:
+                    line.pop("unit_cents", None)
+            if quantity is not None:
+                line["quantity"] = quantity
+            if line.get("unit_cents") is not None and old_subtotal is not None:
+                line["subtotal_cents"] = line["unit_cents"] * line["quantity"]
+                cart["subtotal"] += line["subtotal_cents"] - old_subtotal
+            else:
+                line.pop("subtotal_cents", None)
+                cart["v"] = ""
+            cart["count"] += line["quantity"] - old_quantity
+            line["updated_at"] = _now()
+            return copy.deepcopy(line)
+
+    def remove_line(self, user_id: int, cart_item_id: str) -> bool:
+        with self._lock:
+            cart = self._carts.get(user_id)
+            line = cart["lines"].pop(cart_item_id, None) if cart else None
+            if line is None:
+                return False
+            self._unindex(cart, line, cart_item_id)
+            if line.get("subtotal_cents") is not None:
+                cart["subtotal"] -= line["subtotal_cents"]
+            else:
+                cart["v"] = ""
+            cart["count"] -= line["quantity"]
+            return True
+
+    def reprice(self, user_id, state, version, lines, drop_ids):
+        with self._lock:
+            cart = self._cart(user_id)
+            for cart_item_id in drop_ids:
+                line = cart["lines"].pop(cart_item_id, None)
+                if line is not None:
+                    self._unindex(cart, line, cart_item_id)
+            repriced = set()
+            for cart_item_id, line in lines.items():
+                if cart["lines"].get(cart_item_id) == state.token.get(cart_item_id):
+                    cart["lines"][cart_item_id] = copy.deepcopy(line)
+                    repriced.add(cart_item_id)
+            cart["subtotal"] = sum(line.get("subtotal_cents") or 0 for line in cart["lines"].values())
+            cart["count"] = sum(line["quantity"] for line in cart["lines"].values())
+            cart["v"] = version if repriced >= set(cart["lines"]) else ""
+            return cart["subtotal"], cart["count"]
+
+    def clear(self, user_id: int) -> None:
+        with self._lock:
+            self._carts.pop(user_id, None)
+
+    def replace(self, user_id: int, lines: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            cart = self._carts[user_id] = {"lines": {}, "index": {}, "subtotal": 0, "count": 0, "v": None}
+            for line in copy.deepcopy(lines):
+                cart["lines"][line["id"]] = line
+                cart["index"].setdefault(canonical_line_key(line), line["id"])
+
+
+# ====== SQL（carts / cart_items / cart_item_modifiers） ======
+
+class SQLCartStore(CartStore):
+    """
+    cart_item_id 为 cart_items.id 的字符串形式。
+    表中只有产品、数量和 modifier，不保存价格快照和总价：totals() 返回 None，
+    读出的行不带目录版本，order_crud 会按目录快照重新定价（目录快照在内存中，不额外查库）。
+    每个操作使用独立的会话并立即提交。
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal):
+        self.session_factory = session_factory
+
+    @staticmethod
+    def _cart_id(db: Session, user_id: int, create: bool = False) -> Optional[int]:
+        cart_id = db.execute(select(Cart.id).where(Cart.user_id == user_id)).scalar_one_or_none()
+        if cart_id is None and create:
+            try:
+                with db.begin_nested():
+                    cart = Cart(user_id=user_id)
+                    db.add(cart)
+                    db.flush()
+                cart_id = cart.id
+            except IntegrityError:
+                # 并发请求已经建好了购物车
+                cart_id = db.execute(select(Cart.id).where(Cart.user_id == user_id)).scalar_one()
+        return cart_id
+
+    @staticmethod
+    def _lines_by_cart(db: Session, cart_ids: List[int],
+                       item_ids: Optional[List[int]] = None) -> Dict[int, Dict[str, Dict[str, Any]]]:
+        """多个购物车的行（或其中指定的行），两次查询：cart_items + cart_item_modifiers"""
+        result: Dict[int, Dict[str, Dict[str, Any]]] = {cart_id: {} for cart_id in cart_ids}
+        if not cart_ids:
+            return result
+        query = select(CartItem).where(CartItem.cart_id.in_(cart_ids))
+        if item_ids is not None:
+            query = query.where(CartItem.id.in_(item_ids))
+        items = db.execute(query.order_by(CartItem.id)).scalars().all()
+        modifiers: Dict[int, List[int]] = {}
+        if items:
+            rows = db.execute(
+                select(CartItemModifier.cart_item_id, CartItemModifier.modifier_id)
+                .where(CartItemModifier.cart_item_id.in_([item.id for item in items]))
+                .order_by(CartItemModifier.id)
+            ).all()
+            for row in rows:
+                modifiers.setdefault(row.cart_item_id, []).append(row.modifier_id)
+        for item in items:
+            result[item.cart_id][str(item.id)] = {
+                "id": str(item.id),
+                "product_id": item.product_id,
+                "quantity": item.quantity,
+                "modifiers": modifiers.get(item.id, []),
+                "created_at": item.created_at.isoformat() if item.created_at else None,
+            }
+        return result
+
+    @classmethod
+    def _lines(cls, db: Session, cart_id: int, item_ids: Optional[List[int]] = None) -> Dict[str, Dict[str, Any]]:
+        return cls._lines_by_cart(db, [cart_id], item_ids)[cart_id]
+
+    @staticmethod
+    def _item_id(cart_item_id: str) -> Optional[int]:
+        return int(cart_item_id) if cart_item_id.isdigit() else None
+
+    @staticmethod
+    def _insert_modifiers(db: Session, item_id: int, modifier_ids: List[int]) -> None:
+        if modifier_ids:
+            db.add_all([CartItemModifier(cart_item_id=item_id, modifier_id=m) for m in modifier_ids])
+
+    @staticmethod
+    def _delete_items(db: Session, item_ids: List[int]) -> None:
+        if item_ids:
+            db.execute(delete(CartItemModifier).where(CartItemModifier.cart_item_id.in_(item_ids)))
+            db.execute(delete(CartItem).where(CartItem.id.in_(item_ids)))
+
+    def load(self, user_id: int) -> CartState:
+        with self.session_factory() as db:
+            cart_id = self._cart_id(db, user_id)
+            lines = self._lines(db, cart_id) if cart_id is not None else {}
+        count = sum(line["quantity"] for line in lines.values())
+        return CartState(lines, CartTotals(0, count, None))
+
+    def totals(self, user_id: int) -> Optional[CartTotals]:
+        return None
+
+    def get_product_id(self, user_id: int, cart_item_id: str) -> Optional[int]:
+        item_id = self._item_id(cart_item_id)
+        if item_id is None:
+            return None
+        with self.session_factory() as db:
+            return db.execute(
+                select(CartItem.product_id)
+                .join(Cart, Cart.id == CartItem.cart_id)
+                .where(CartItem.id == item_id, Cart.user_id == user_id)
+            ).scalar_one_or_none()
+
+    def add_line(self, user_id, line, version, merge):
+        with self.session_factory() as db:
+            cart_id = self._cart_id(db, user_id, create=True)
+            # 表中不记录 merge=false，相同配置的行都可以作为合并目标
+            if merge:
+                key = canonical_line_key(line)
+                for existing in self._lines(db, cart_id).values():
+                    if canonical_line_key(existing) == key:
+                        # 在数据库中累加，并发的添加不会互相覆盖
+                        item_id = int(existing["id"])
+                        db.execute(
+                            update(CartItem)
+                            .where(CartItem.id == item_id)
+                            .values(quantity=CartItem.quantity + line["quantity"])
+                        )
+                        existing["quantity"] = db.execute(
+                            select(CartItem.quantity).where(CartItem.id == item_id)
+                        ).scalar_one()
+                        db.commit()
+                        return existing
+
+            item = CartItem(cart_id=cart_id, product_id=line["product_id"], quantity=line["quantity"])
+            db.add(item)
+            db.flush()
+            self._insert_modifiers(db, item.id, line.get("modifiers") or [])
+            db.commit()
+            # 价格快照不落库，但原样返回给调用方用于本次响应
+            return dict(line, id=str(item.id))
+
+    def update_line(self, user_id, cart_item_id, quantity, modifier_ids, mods, mods_cents, version):
+        item_id = self._item_id(cart_item_id)
+        if item_id is None:
+            return None
+        with self.session_factory() as db:
+            cart_id = self._cart_id(db, user_id)
+            if cart_id is None:
+                return None
+            item = db.execute(
+                select(CartItem).where(CartItem.id == item_id, CartItem.cart_id == cart_id)
+            ).scalar_one_or_none()
+            if item is None:
+                return None
+            if quantity is not None:
+                item.quantity = quantity
+            if modifier_ids is not None:
+                db.execute(delete(CartItemModifier).where(CartItemModifier.cart_item_id == item_id))
+                self._insert_modifiers(db, item_id, modifier_ids)
+            db.commit()
+            return self._lines(db, cart_id, [item_id]).get(cart_item_id)
+
+    def remove_line(self, user_id: int, cart_item_id: str) -> bool:
+        item_id = self._item_id(cart_item_id)
+        if item_id is None:
+            return False
+        with self.session_factory() as db:
+            found = db.execute(
+                select(CartItem.id)
+                .join(Cart, Cart.id == CartItem.cart_id)
+                .where(CartItem.id == item_id, Cart.user_id == user_id)
+            ).scalar_one_or_none()
+            if found is None:
+                return False
+            self._delete_items(db, [item_id])
+            db.commit()
+            return True
+
+    def reprice(self, user_id, state, version, lines, drop_ids):
+        # 价格不落库，只需要删掉产品已不存在的行
+        if drop_ids:
+            with self.session_factory() as db:
+                cart_id = self._cart_id(db, user_id)
+                if cart_id is not None:
+                    item_ids = db.execute(
+                        select(CartItem.id).where(
+                            CartItem.cart_id == cart_id,
+                            CartItem.id.in_([self._item_id(cid) for cid in drop_ids if cid.isdigit()])
+                        )
+                    ).scalars().all()
+                    self._delete_items(db, list(item_ids))
+                    db.commit()
+        return _sum_lines(lines)
+
+    def clear(self, user_id: int) -> None:
+        with self.session_factory() as db:
+            cart_id = self._cart_id(db, user_id)
+            if cart_id is None:
+                return
+            item_ids = db.execute(select(CartItem.id).where(CartItem.cart_id == cart_id)).scalars().all()
+            self._delete_items(db, list(item_ids))
+            db.commit()
+
+
+    def replace(self, user_id: int, lines: List[Dict[str, Any]]) -> None:
+        self.replace_many({user_id: lines})
+
+    def replace_many(self, carts: Dict[int, List[Dict[str, Any]]]) -> None:
+        """在一个事务中整体替换多个用户的购物车（写回 / 故障切换时批量使用）"""
+        if not carts:
+            return
+        with self.session_factory() as db:
+            cart_ids = dict(db.execute(
+                select(Cart.user_id, Cart.id).where(Cart.user_id.in_(list(carts)))
+            ).all())
+            if cart_ids:
+                # 只改明细不会触发 carts.updated_at 的 ON UPDATE，这里显式刷新（recent_carts 依赖它）
+                db.execute(
+                    update(Cart).where(Cart.id.in_(list(cart_ids.values()))).values(updated_at=func.now())
+                )
+            missing = [Cart(user_id=user_id) for user_id in carts if user_id not in cart_ids]
+            if missing:
+                db.add_all(missing)
+                db.flush()
+                cart_ids.update({cart.user_id: cart.id for cart in missing})
+
+            old_item_ids = db.execute(
+                select(CartItem.id).where(CartItem.cart_id.in_(list(cart_ids.values())))
+            ).scalars().all()
+            self._delete_items(db, list(old_item_ids))
+
+            items = []
+            for user_id, lines in carts.items():
+                for line in lines:
+                    item = CartItem(cart_id=cart_ids[user_id], product_id=line["product_id"], quantity=line["quantity"])
+                    items.append((item, line.get("modifiers") or []))
+            db.add_all([item for item, _ in items])
+            db.flush()
+            db.add_all([
+                CartItemModifier(cart_item_id=item.id, modifier_id=modifier_id)
+                for item, modifier_ids in items
+                for modifier_id in modifier_ids
+            ])
+            db.commit()
+
+    def non_empty_carts(self) -> Dict[int, List[Dict[str, Any]]]:
+        """所有非空购物车：{user_id: 行列表}"""
+        with self.session_factory() as db:
+            carts = dict(db.execute(
+                select(Cart.id, Cart.user_id)
+                .where(Cart.id.in_(select(CartItem.cart_id).distinct()))
+            ).all())
+            lines = self._lines_by_cart(db, list(carts))
+        return {carts[cart_id]: list(rows.values()) for cart_id, rows in lines.items() if rows}
+
+    def remove_lines(self, user_id: int, cart_item_ids: List[str]) -> None:
+        """删除指定的行（只删属于该用户的）"""
+        item_ids = [self._item_id(cid) for cid in cart_item_ids if cid.isdigit()]
+        if not item_ids:
+            return
+        with self.session_factory() as db:
+            owned = db.execute(
+                select(CartItem.id)
+                .join(Cart, Cart.id == CartItem.cart_id)
+                .where(CartItem.id.in_(item_ids), Cart.user_id == user_id)
+            ).scalars().all()
+            self._delete_items(db, list(owned))
+            db.commit()
+
+    def recent_carts(self, max_age_seconds: int) -> Dict[int, List[Dict[str, Any]]]:
+        """最近 max_age_seconds 内写入过、且非空的购物车：{user_id: 行列表}"""
+        with self.session_factory() as db:
+            carts = dict(db.execute(
+                select(Cart.id, Cart.user_id).where(
+                    Cart.updated_at >= datetime.now() - timedelta(seconds=max_age_seconds)
+                )
+            ).all())
+            lines = self._lines_by_cart(db, list(carts))
+        return {carts[cart_id]: list(rows.values()) for cart_id, rows in lines.items() if rows}
+
+
+# ====== Redis 为主、SQL 为后备 ======
+
+class FailoverCartStore(CartStore):
+    """
+    - Redis 连接失败时，这次操作立即改在 SQL 上完成，之后的请求直接走 SQL（不再逐个等待 Redis 超时）。
+      写操作只有在建立连接时失败才改在 SQL 上重做；命令发出后超时或断开的写操作同样切换到 SQL，
+      但这次的错误照常抛出（Redis 上可能已经执行过，重做会重复写入）
+    - 后台线程按 retry_seconds 探测 Redis；恢复后先切回 Redis，再把故障期间写进 SQL 的行合并进
+      Redis 中已有的购物车（只增不删，Redis 中故障前的行保留）
+    - 是否可用是每个进程自己判断的：只有部分 worker 连不上 Redis 时，这些 worker 的写入进了 SQL。
+      没开启写回时 SQL 表只用来临时存放这些行，所以任何一个连得上 Redis 的 worker 都会在每个
+      retry_seconds 把 SQL 中的行合并进 Redis 并删掉（Redis 锁保证只有一个 worker 在合并）
+    - 写回（write_behind_seconds > 0）：记录在 Redis 上写过的用户，定期批量把这些购物车写入 SQL；
+      Redis 丢数据重启后（哨兵 key 消失），把 SQL 中 TTL 内的购物车恢复到 Redis。
+      此时 SQL 中是完整副本，故障期间的清空、删除、减少数量都只记录在 SQL 中，所以恢复时本进程
+      故障期间写过的用户以 SQL 为准覆盖 Redis 中的购物车
+    """
+
+    def __init__(
+        self,
+        primary: RedisCartStore,
+        fallback: SQLCartStore,
+        retry_seconds: float = CART_REDIS_RETRY_SECONDS,
+        write_behind_seconds: float = CART_WRITE_BEHIND_SECONDS,
+    ):
+        self.primary = primary
+        self.fallback = fallback
+        self.retry_seconds = retry_seconds
+        self.write_behind_seconds = write_behind_seconds
+        self._lock = threading.Lock()
+        self._available = True
+        self._failed_over: Set[int] = set()  # 写回开启时，故障期间在 SQL 中写过的用户
+        self._dirty: Set[int] = set()  # 等待写回的用户
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def available(self) -> bool:
+        """当前是否在使用 Redis"""
+        return self._available
+
+    def _mark_unavailable(self, error: Exception) -> None:
+        with self._lock:
+            if self._available:
+                print(f"Redis 不可用，购物车切换到 SQL: {error}")
+            self._available = False
+        self._ensure_thread()
+
+    def _call(self, method: str, user_id: int, *args, write: bool = False) -> Any:
+        if self._available:
+            try:
+                result = getattr(self.primary, method)(user_id, *args)
+            except REDIS_OUTAGE_ERRORS as e:
+                self._mark_unavailable(e)
+                if write and not _failed_before_send(e):
+                    # 不确定 Redis 上是否已经写入：错误返回给客户端，由客户端决定是否重试
+                    raise
+            else:
+                if write and self.write_behind_seconds > 0:
+                    with self._lock:
+                        self._dirty.add(user_id)
+                return result
+        if write and self.write_behind_seconds > 0:
+            with self._lock:
+                self._failed_over.add(user_id)
+        return getattr(self.fallback, method)(user_id, *args)
+
+    # ---- CartStore ----
+
+    def warm_up(self) -> None:
+        try:
+            self.primary.warm_up()
+        except REDIS_OUTAGE_ERRORS as e:
+            self._mark_unavailable(e)
+        self._ensure_thread()
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.retry_seconds + 1)
+            self._thread = None
+        # 退出前把还没写回的购物车写完
+        if self.write_behind_seconds > 0 and self._available:
+            self.flush()
+
+    def load(self, user_id: int) -> CartState:
+        # 记住这次读自哪个存储，reprice 时写回同一个存储
+        if self._available:
+            try:
+                state = self.primary.load(user_id)
+            except REDIS_OUTAGE_ERRORS as e:
+                self._mark_unavailable(e)
+            else:
+                return dataclasses.replace(state, token=(self.primary, state.token))
+        state = self.fallback.load(user_id)
+        return dataclasses.replace(state, token=(self.fallback, state.token))
+
+    def totals(self, user_id: int) -> Optional[CartTotals]:
+        return self._call("totals", user_id)
+
+    def get_product_id(self, user_id: int, cart_item_id: str) -> Optional[int]:
+        return self._call("get_product_id", user_id, cart_item_id)
+
+    def add_line(self, user_id, line, version, merge):
+        return self._call("add_line", user_id, line, version, merge, write=True)
+
+    def update_line(self, user_id, cart_item_id, quantity, modifier_ids, mods, mods_cents, version):
+        return self._call(
+            "update_line", user_id, cart_item_id, quantity, modifier_ids, mods, mods_cents, version, write=True
+        )
+
+    def remove_line(self, user_id: int, cart_item_id: str) -> bool:
+        return self._call("remove_line", user_id, cart_item_id, write=True)
+
+    def reprice(self, user_id, state, version, lines, drop_ids):
+        store, token = state.token
+        inner = dataclasses.replace(state, token=token)
+        if store is self.fallback:
+            return self.fallback.reprice(user_id, inner, version, lines, drop_ids)
+        if self._available:
+            try:
+                result = self.primary.reprice(user_id, inner, version, lines, drop_ids)
+            except REDIS_OUTAGE_ERRORS as e:
+                self._mark_unavailable(e)
+            else:
+                if drop_ids and self.write_behind_seconds > 0:
+                    with self._lock:
+                        self._dirty.add(user_id)
+                return result
+        # 读完之后 Redis 断开：这次不写回，只返回本次定价的汇总
+        return _sum_lines(lines)
+
+    def clear(self, user_id: int) -> None:
+        self._call("clear", user_id, write=True)
+
+    def replace(self, user_id: int, lines: List[Dict[str, Any]]) -> None:
+        self._call("replace", user_id, lines, write=True)
+
+    # ---- 后台：探测恢复 / 写回 ----
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cart-store-sync", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        tick = self.retry_seconds
+        if self.write_behind_seconds > 0:
+            tick = min(tick, self.write_behind_seconds)
+        next_flush = time.monotonic() + self.write_behind_seconds
+        while not self._stop.wait(tick):
+            try:
+                if not self._available:
+                    self._try_recover()
+                    continue
+                # 本进程或其他 worker 在 Redis 故障期间写进 SQL 的行
+                if self.write_behind_seconds <= 0 or self._failed_over:
+                    self._reconcile()
+                if self.write_behind_seconds > 0:
+                    self._restore_if_reset()
+                    if time.monotonic() >= next_flush:
+                        self.flush()
+                        next_flush = time.monotonic() + self.write_behind_seconds
+            except REDIS_OUTAGE_ERRORS as e:
+                self._mark_unavailable(e)
+            except SQLAlchemyError as e:
+                print(f"购物车同步失败: {e}")
+
+    def _try_recover(self) -> None:
+        """Redis 恢复：先切回 Redis（之后的写入都进 Redis），再合并故障期间写进 SQL 的行"""
+        self.primary.client.ping()
+        if self.write_behind_seconds > 0:
+            # 覆盖 Redis 要在切回之前做：切回之后在 Redis 上的新写入不能被 SQL 中的副本覆盖掉。
+            # 覆盖期间还在写 SQL 的用户重新记进 _failed_over，切回之后再覆盖一次
+            self._reconcile()
+        with self._lock:
+            self._available = True
+        print("Redis 已恢复，购物车切回 Redis")
+        self._reconcile()
+
+    def _reconcile(self) -> None:
+        """
+        写回开启时：故障期间写过的用户用 SQL 中的副本覆盖 Redis；
+        没开启写回时：把写进 SQL 的行逐行合并进 Redis，合并成功后才删除 SQL 中的这一行。中途失败下一轮继续
+        """
+        client = self.primary.client
+        if not client.set(CART_RECONCILE_LOCK_KEY, 1, nx=True, ex=CART_RECONCILE_LOCK_SECONDS):
+            return
+        try:
+            if self.write_behind_seconds > 0:
+                with self._lock:
+                    users, self._failed_over = self._failed_over, set()
+                pending = list(users)
+                try:
+                    while pending:
+                        user_id = pending[0]
+                        self.primary.replace(user_id, list(self.fallback.load(user_id).lines.values()))
+                        pending.pop(0)
+                        # SQL 中的副本之后由写回覆盖
+                        with self._lock:
+                            self._dirty.add(user_id)
+                except Exception:
+                    with self._lock:
+                        self._failed_over.update(pending)
+                    raise
+            else:
+                carts = self.fallback.non_empty_carts()
+                for user_id, lines in carts.items():
+                    for line in lines:
+                        self.primary.add_line(user_id, self._to_primary_line(line), "", True)
+                        self.fallback.remove_lines(user_id, [line["id"]])
+                if carts:
+                    print(f"已把 {len(carts)} 个购物车中写进 SQL 的行合并回 Redis")
+        finally:
+            client.delete(CART_RECONCILE_LOCK_KEY)
+
+    @staticmethod
+    def _to_primary_line(line: Dict[str, Any]) -> Dict[str, Any]:
+        """SQL 中的行换成 Redis 的行：新的 cart_item_id，不带价格快照（目录版本为空，读取时重新定价）"""
+        cart_item_id = f"{int(time.time() * 1000)}_{secrets.token_hex(4)}"
+        return {
+            "id": cart_item_id,
+            "product_id": line["product_id"],
+            "quantity": line["quantity"],
+            "modifiers": line.get("modifiers") or [],
+            "created_at": line.get("created_at") or _now(),
+            "updated_at": _now(),
+            "subtotal_cents": 0,
+        }
+
+    def _restore_if_reset(self) -> None:
+        """哨兵 key 不存在（Redis 是空的）时，把 SQL 中 TTL 内的购物车恢复到 Redis；Redis 中已有的购物车不覆盖"""
+        client = self.primary.client
+        if not client.set(CART_PERSISTED_SENTINEL_KEY, 1, nx=True):
+            return
+        carts = self.fallback.recent_carts(self.primary.ttl)
+        for user_id, lines in carts.items():
+            if not client.exists(self.primary.cart_key(user_id)):
+                self.primary.replace(user_id, lines)
+        if carts:
+            print(f"Redis 购物车为空，已从 SQL 恢复 {len(carts)} 个购物车")
+
+    def flush(self) -> None:
+        """写回：把等待写回的购物车从 Redis 读出，分批写入 SQL（每批一个事务）"""
+        with self._lock:
+            users, self._dirty = list(self._dirty), set()
+        for i in range(0, len(users), CART_WRITE_BEHIND_BATCH_SIZE):
+            batch = users[i:i + CART_WRITE_BEHIND_BATCH_SIZE]
+            try:
+                carts = {user_id: list(self.primary.load(user_id).lines.values()) for user_id in batch}
+                self.fallback.replace_many(carts)
+            except Exception:
+                # 没写成功的留到下一轮
+                with self._lock:
+                    self._dirty.update(users[i:])
+                raise
+
+
+def _redis_cart_store() -> CartStore:
+    if CART_SQL_FALLBACK:
+        return FailoverCartStore(RedisCartStore(), SQLCartStore())
+    return RedisCartStore()
+
+
+CART_STORE_BACKENDS: Dict[str, Callable[[], CartStore]] = {
+    "redis": _redis_cart_store,
+    "memory": MemoryCartStore,
+    "sql": SQLCartStore,
+}
+
+
+def create_cart_store(backend: str = CART_STORE_BACKEND) -> CartStore:
+    try:
+        return CART_STORE_BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(f"Unknown cart store backend: {backend}")
+
+
+# 创建全局实例（由 CART_STORE_BACKEND 决定实现）
+cart_store = create_cart_store()
@@ -0,0 +1,65 @@
+"""
+Catalog bundle CSV format
+批量导入 / 导出的 CSV 格式：一张表里放所有实体，用 kind 列区分
+  kind      | 使用的列
+  category  | id, name
+  product   | id, name, price, type_id
+  modifier  | id, name, type, price, is_active
+  link      | product_id, modifier_id
+  allergen  | product_id, allergen
+其余列留空。JSON 格式直接对应 CatalogBundle。
+"""
+import csv
+import io
+from typing import Any, Dict, Iterable, Iterator, List
+
+from backend.schemas.catalog_schemas import CatalogBundle
+
+CSV_COLUMNS = [
+    "kind", "id", "name", "price", "type_id", "type", "is_active",
+    "product_id", "modifier_id", "allergen",
+]
+
+# kind -> (CatalogBundle 中的字段名, 该 kind 使用的列)
+CSV_KINDS = {
+    "category": ("categories", ["id", "name"]),
+    "product": ("products", ["id", "name", "price", "type_id"]),
+    "modifier": ("modifiers", ["id", "name", "type", "price", "is_active"]),
+    "link": ("links", ["product_id", "modifier_id"]),
+    "allergen": ("allergens", ["product_id", "allergen"]),
+}
+
+
+def parse_csv_bundle(text: str) -> CatalogBundle:
+    """CSV -> CatalogBundle；未知 kind 抛 ValueError，字段校验交给 pydantic"""
+    sections: Dict[str, List[Dict[str, Any]]] = {field: [] for field, _ in CSV_KINDS.values()}
+    reader = csv.DictReader(io.StringIO(text))
+    for line_no, row in enumerate(reader, start=2):
+        kind = (row.get("kind") or "").strip().lower()
+        if kind not in CSV_KINDS:
+            raise ValueError(f"Line {line_no}: unknown kind '{kind}'")
+        field, columns = CSV_KINDS[kind]
+        sections[field].append({
+            col: row[col].strip() for col in columns
+            if row.get(col) is not None and row[col].strip() != ""
+        })
+    return CatalogBundle.model_validate(sections)
+
+
+def csv_header() -> str:
+    return _csv_line(CSV_COLUMNS)
+
+
+def csv_rows(kind: str, records: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """把某一类实体的记录逐行编码为 CSV 文本"""
+    _, columns = CSV_KINDS[kind]
+    for record in records:
+        values = {col: record.get(col) for col in columns}
+        values["kind"] = kind
+        yield _csv_line(["" if values.get(col) is None else values[col] for col in CSV_COLUMNS])
+
+
+def _csv_line(values: List[Any]) -> str:
+    buf = io.StringIO()
+    csv.writer(buf).writerow(values)
+    return buf.getvalue()
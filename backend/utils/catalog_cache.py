@@ -0,0 +1,387 @@
+"""
+Catalog snapshot cache
+进程内的商品目录快照缓存：
+- 菜单一天只改几次，但 /catalog/products、/catalog/categories、/order/menu 每秒都在查
+- 每个 worker 持有一份不可变的、带版本号的目录快照（分类、产品、modifier、关联、过敏原）
+- admin_catalog_crud 的每次写操作都会 bump 版本号并原子地重建快照
+- 多 worker / 多机：版本号存放在 Redis（catalog:version），写操作通过 pub/sub 广播，
+  每个 worker 的后台监听线程收到消息后让本地快照失效；订阅期间也定期轮询版本号，
+  订阅悄悄断开（半开连接收不到消息也不报错）时不会一直停在旧快照
+"""
+import threading
+import time
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from itertools import islice
+from types import MappingProxyType
+from typing import Any, Callable, Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+import redis
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from backend.config import CATALOG_POLL_INTERVAL_SECONDS
+from backend.database import redis_client, SessionLocal
+from backend.models.catalog import Product, ProductType, Modifier, ModifierProduct
+from backend.models.order import ProductAllergen
+from backend.utils.allergen_index import AllergenIndex
+from backend.utils.modifier_compat import ModifierCompatibility
+
+# Redis 中共享的目录版本号 & 失效通知频道
+CATALOG_VERSION_KEY = "catalog:version"
+CATALOG_CHANNEL = "catalog:invalidate"
+
+
+# ====== 快照中的只读行对象 ======
+# 字段与 ORM 模型同名，可以直接交给 response_model（from_attributes）序列化
+
+@dataclass(frozen=True)
+class CategoryRow:
+    id: int
+    name: str
+
+
+@dataclass(frozen=True)
+class ProductRow:
+    id: int
+    name: str
+    price: Decimal
+    type_id: int
+    created_at: Optional[datetime] = None
+
+
+@dataclass(frozen=True)
+class ModifierRow:
+    id: int
+    name: str
+    type: str
+    price: Decimal
+    is_active: int
+
+
+class CatalogSnapshot:
+    """某一版本的完整目录数据，构建完成后不再修改"""
+
+    def __init__(
+        self,
+        version: int,
+        categories: List[CategoryRow],
+        products: List[ProductRow],
+        modifiers: List[ModifierRow],
+        links: List[Tuple[int, int]],
+        allergens: List[Tuple[int, str]],
+    ):
+        self.version = version
+        self._derived: Dict[str, Any] = {}
+        self._derived_lock = threading.Lock()
+        self.categories: Tuple[CategoryRow, ...] = tuple(sorted(categories, key=lambda c: c.id))
+        self.products: Tuple[ProductRow, ...] = tuple(sorted(products, key=lambda p: p.id))
+        self.products_by_id: Mapping[int, ProductRow] = MappingProxyType(
+            {p.id: p for p in self.products}
+        )
+
+        by_category: Dict[int, List[ProductRow]] = {}
+        for p in self.products:
+            by_category.setdefault(p.type_id, []).append(p)
+        self.products_by_category: Mapping[int, Tuple[ProductRow, ...]] = MappingProxyType(
+            {k: tuple(v) for k, v in by_category.items()}
+        )
+
+        self.modifiers_by_id: Mapping[int, ModifierRow] = MappingProxyType(
+            {m.id: m for m in sorted(modifiers, key=lambda m: m.id)}
+        )
+
+        # product_id -> 关联的所有 modifier_id（升序，含未启用的）
+        product_modifiers: Dict[int, List[int]] = {}
+        for product_id, modifier_id in links:
+            product_modifiers.setdefault(product_id, []).append(modifier_id)
+        self.product_modifier_ids: Mapping[int, Tuple[int, ...]] = MappingProxyType(
+            {k: tuple(sorted(v)) for k, v in product_modifiers.items()}
+        )
+
+        # 购物车校验用的 product -> 可选 modifier 索引
+        self.modifier_compat = ModifierCompatibility(
+            self.product_modifier_ids,
+            MappingProxyType({m.id: m.type for m in self.modifiers_by_id.values()}),
+            frozenset(m.id for m in self.modifiers_by_id.values() if m.is_active == 1),
+        )
+
+        # product_id -> 过敏原集合（统一小写）
+        product_allergens: Dict[int, set] = {}
+        for product_id, allergen in allergens:
+            product_allergens.setdefault(product_id, set()).add(allergen.lower())
+        self.product_allergens: Mapping[int, FrozenSet[str]] = MappingProxyType(
+            {k: frozenset(v) for k, v in product_allergens.items()}
+        )
+
+        # id 数组（用于游标分页时二分定位）与过敏原掩码数组，
+        # 都与 products / products_by_category 的顺序一一对应
+        self._product_ids = tuple(p.id for p in self.products)
+        self._category_ids: Mapping[int, Tuple[int, ...]] = MappingProxyType({
+            type_id: tuple(p.id for p in rows)
+            for type_id, rows in self.products_by_category.items()
+        })
+        self.allergen_index = AllergenIndex(self.product_allergens)
+        self._product_masks = self.allergen_index.masks(self._product_ids)
+        self._category_masks: Mapping[int, Tuple[int, ...]] = MappingProxyType({
+            type_id: self.allergen_index.masks(ids)
+            for type_id, ids in self._category_ids.items()
+        })
+
+    def list_products(
+        self,
+        category_id: Optional[int] = None,
+        limit: int = 100,
+        offset: int = 0,
+        exclude_allergens: Optional[List[str]] = None,
+        after_id: Optional[int] = None,
+    ) -> List[ProductRow]:
+        """
+        按分类筛选 + 过敏原排除 + 分页（与原 SQL 一致：按 id 升序）
+        after_id 为游标分页：从 id > after_id 的位置开始（二分定位），offset 在其之后生效
+        """
+        if category_id:
+            rows = self.products_by_category.get(category_id, ())
+            ids = self._category_ids.get(category_id, ())
+            masks = self._category_masks.get(category_id, ())
+        else:
+            rows = self.products
+            ids = self._product_ids
+            masks = self._product_masks
+
+        start = bisect_right(ids, after_id) if after_id is not None else 0
+        exclude_mask = self.allergen_index.mask_for(exclude_allergens) if exclude_allergens else 0
+        if not exclude_mask:
+            return list(rows[start + offset:start + offset + limit])
+
+        selected = self.allergen_index.exclude(
+            islice(rows, start, None), islice(masks, start, None), exclude_mask
+        )
+        return list(islice(selected, offset, offset + limit))
+
+    def active_modifiers(self, product_id: int) -> List[ModifierRow]:
+        """产品关联的 is_active=1 的 modifier，按 id 升序"""
+        result = []
+        for modifier_id in self.product_modifier_ids.get(product_id, ()):
+            modifier = self.modifiers_by_id.get(modifier_id)
+            if modifier is not None and modifier.is_active == 1:
+                result.append(modifier)
+        return result
+
+    def allergens_of(self, product_id: int) -> List[str]:
+        return sorted(self.product_allergens.get(product_id, ()))
+
+    def memoize(self, name: str, factory: Callable[["CatalogSnapshot"], Any]) -> Any:
+        """按快照缓存派生数据（例如预编译的菜单文档），每个版本只计算一次"""
+        value = self._derived.get(name)
+        if value is not None:
+            return value
+        with self._derived_lock:
+            value = self._derived.get(name)
+            if value is None:
+                value = factory(self)
+                self._derived[name] = value
+            return value
+
+
+def build_snapshot(db: Session, version: int) -> CatalogSnapshot:
+    """从数据库加载整份目录（每张表一次查询）"""
+    categories = [
+        CategoryRow(id=c.id, name=c.name)
+        for c in db.execute(select(ProductType)).scalars().all()
+    ]
+    products = [
+        ProductRow(id=p.id, name=p.name, price=p.price, type_id=p.type_id, created_at=p.created_at)
+        for p in db.execute(select(Product)).scalars().all()
+    ]
+    modifiers = [
+        ModifierRow(id=m.id, name=m.name, type=m.type, price=m.price, is_active=m.is_active)
+        for m in db.execute(select(Modifier)).scalars().all()
+    ]
+    links = [
+        (row.product_id, row.modifier_id)
+        for row in db.execute(select(ModifierProduct.product_id, ModifierProduct.modifier_id)).all()
+    ]
+    allergens = [
+        (row.product_id, row.allergen)
+        for row in db.execute(select(ProductAllergen.product_id, ProductAllergen.allergen)).all()
+    ]
+    return CatalogSnapshot(version, categories, products, modifiers, links, allergens)
+
+
+class CatalogCache:
+    """
+    持有当前快照的引用。
+    读路径无锁：版本号匹配就直接返回快照；不匹配时加锁重建，再整体替换引用（原子切换）。
+    """
+
+    def __init__(self, client: redis.Redis = redis_client, session_factory: Callable[[], Session] = SessionLocal):
+        self._client = client
+        self._session_factory = session_factory
+        self._lock = threading.Lock()
+        # 快照使用的版本号：通常等于 Redis 中的版本号，Redis 不可用时的本地 bump 除外
+        self._version = 1
+        # 最近一次从 Redis 得到的版本号；比它新的 Redis 版本号总会让本地快照重建
+        self._redis_version = 0
+        # Redis 不可用时 bump 过、还没有 INCR + PUBLISH 通知其他 worker
+        self._pending_publish = False
+        self._snapshot: Optional[CatalogSnapshot] = None
+
+    @property
+    def version(self) -> int:
+        """当前目录版本号（不触发任何查询）"""
+        return self._version
+
+    def get_snapshot(self, db: Optional[Session] = None) -> CatalogSnapshot:
+        """
+        当前版本的快照。db 只为兼容调用方保留：重建总是用独立的新会话，
+        调用方的会话可能已经在事务中读过数据（REPEATABLE READ 下看不到之后提交的目录变更），
+        用它重建会把旧数据标上新版本号，一直留到下一次目录变更
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self._version:
+            return snapshot
+
+        with self._lock:
+            # 双重检查：可能其他线程已经重建好了
+            snapshot = self._snapshot
+            version = self._version
+            if snapshot is not None and snapshot.version == version:
+                return snapshot
+            # 重建期间若版本又被 bump，快照带的是旧版本号，下次读取会再次重建
+            with self._session_factory() as session:
+                snapshot = build_snapshot(session, version)
+            self._snapshot = snapshot
+            return snapshot
+
+    def observe_version(self, version: int) -> bool:
+        """
+        接收来自 Redis 的版本号（pub/sub 消息或轮询结果）。
+        比上次从 Redis 得到的新才采用，本地快照随之失效（下次读取时重建）；迟到的旧版本号（例如较早发出的轮询结果）忽略。
+        与本地 bump 的版本号无关：本地 bump 之后其他 worker 的变更同样会让快照重建。
+        """
+        with self._lock:
+            if version <= self._redis_version:
+                return False
+            self._redis_version = version
+            self._version = version
+            return True
+
+    def sync_version(self) -> None:
+        """
+        从 Redis 读取共享版本号；key 不存在时用毫秒时间戳初始化，保证 flush 之后版本号依然单调。
+        Redis 不可用期间本地 bump 过时，先补发 INCR + PUBLISH，让其他 worker 也看到那次变更
+        """
+        if self._pending_publish:
+            try:
+                self._publish()
+            except redis.RedisError:
+                pass
+            return
+        try:
+            self._client.set(CATALOG_VERSION_KEY, int(time.time() * 1000), nx=True)
+            value = self._client.get(CATALOG_VERSION_KEY)
+        except redis.RedisError:
+            return
+        if value is not None:
+            self.observe_version(int(value))
+
+    def invalidate(self, db: Optional[Session] = None) -> int:
+        """
+        bump 版本号并通知其他 worker；传入 db 时立即重建，否则在下次读取时重建。
+        Redis 不可用时只在本进程内 bump，等 Redis 可用后由监听线程补发通知（sync_version）。
+        本地 bump 用当前毫秒时间戳作版本号：Redis 中的版本号从初始化时的毫秒时间戳开始每次变更只加 1，
+        不会与之重复，两个 worker 不会用同一个 ETag 返回不同的目录
+        """
+        try:
+            version = self._publish()
+        except redis.RedisError:
+            with self._lock:
+                self._version = max(int(time.time() * 1000), self._version + 1)
+                self._pending_publish = True
+                version = self._version
+        if db is not None:
+            self.get_snapshot(db)
+        return version
+
+    def _publish(self) -> int:
+        """INCR 共享版本号并广播；成功后之前没补发的本地 bump 也一并通知到了"""
+        pipe = self._client.pipeline(transaction=False)
+        pipe.set(CATALOG_VERSION_KEY, int(time.time() * 1000), nx=True)
+        pipe.incr(CATALOG_VERSION_KEY)
+        version = int(pipe.execute()[-1])
+        self._pending_publish = False
+        self._client.publish(CATALOG_CHANNEL, version)
+        self.observe_version(version)
+        return version
+
+
+class CatalogInvalidationListener:
+    """
+    后台监听线程：订阅 catalog:invalidate，收到版本号后让本地快照失效。
+    订阅期间也按 CATALOG_POLL_INTERVAL_SECONDS 读一次版本号（一次 GET）：半开的连接（网络分区、没有 RST）
+    上 get_message 一直返回 None 而不报错，只靠订阅会一直停在旧快照。订阅报错断开时同样轮询，并持续尝试重新订阅。
+    """
+
+    def __init__(
+        self,
+        cache: CatalogCache,
+        client: redis.Redis = redis_client,
+        poll_interval: float = CATALOG_POLL_INTERVAL_SECONDS,
+    ):
+        self._cache = cache
+        self._client = client
+        self._poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._cache.sync_version()
+        self._thread = threading.Thread(
+            target=self._run, name="catalog-invalidation-listener", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self._poll_interval + 1)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(CATALOG_CHANNEL)
+                # 订阅成功后补一次版本号，避免错过断线期间的变更
+                self._cache.sync_version()
+                next_sync = time.monotonic() + self._poll_interval
+                while not self._stop.is_set():
+                    message = pubsub.get_message(timeout=min(1.0, self._poll_interval))
+                    if message and message.get("type") == "message":
+                        try:
+                            self._cache.observe_version(int(message["data"]))
+                        except (TypeError, ValueError):
+                            pass
+                    if time.monotonic() >= next_sync:
+                        self._cache.sync_version()
+                        next_sync = time.monotonic() + self._poll_interval
+            except (redis.RedisError, OSError):
+                # 订阅断开：退化为轮询版本号，随后重新尝试订阅
+                self._cache.sync_version()
+                self._stop.wait(self._poll_interval)
+            finally:
+                try:
+                    pubsub.close()
+                except (redis.RedisError, OSError):
+                    pass
+
+
+# 创建全局实例
+catalog_cache = CatalogCache()
+catalog_listener = CatalogInvalidationListener(catalog_cache)
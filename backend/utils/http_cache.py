@@ -0,0 +1,62 @@
+"""
+HTTP caching helpers (ETag / If-None-Match / Cache-Control)
+目录类接口的条件请求：
+- ETag 由目录版本号生成（admin_catalog_crud 写操作会 bump 版本号），不需要查库就能算出来
+- 请求带 If-None-Match 且与当前 ETag 一致时直接返回 304，跳过数据库查询和 pydantic 序列化
+- Cache-Control 让浏览器和中间代理也能分担轮询压力
+"""
+from typing import Optional
+
+from fastapi import Request, Response
+
+from backend.config import CATALOG_CACHE_MAX_AGE_SECONDS, CATALOG_CACHE_STALE_SECONDS
+from backend.utils.catalog_cache import catalog_cache
+
+
+def catalog_etag(variant: Optional[str] = None, version: Optional[int] = None) -> str:
+    """
+    当前目录版本对应的强 ETag。
+    同一 URL 有多种表示（例如不同 Content-Encoding）时用 variant 区分。
+    """
+    if version is None:
+        version = catalog_cache.version
+    if variant:
+        return f'"catalog-{version}-{variant}"'
+    return f'"catalog-{version}"'
+
+
+def catalog_cache_control(public: bool = True) -> str:
+    scope = "public" if public else "private"
+    return (
+        f"{scope}, max-age={CATALOG_CACHE_MAX_AGE_SECONDS}, "
+        f"stale-while-revalidate={CATALOG_CACHE_STALE_SECONDS}"
+    )
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match 是否命中（支持 * 和逗号分隔的多个值；按 RFC 7232 对 If-None-Match 使用弱比较）"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified(etag: str, public: bool = True) -> Response:
+    """304 响应：没有响应体，只带缓存相关的头"""
+    return Response(
+        status_code=304,
+        headers={"ETag": etag, "Cache-Control": catalog_cache_control(public)},
+    )
+
+
+def set_cache_headers(response: Response, etag: str, public: bool = True) -> None:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = catalog_cache_control(public)
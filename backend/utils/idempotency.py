@@ -0,0 +1,100 @@
+"""
+Redis-backed idempotency keys
+客户端在请求头 Idempotency-Key 中带一个自己生成的唯一值，网络不稳定重试时带同一个值：
+- 第一次请求：SET NX 占位（pending，带较短的 TTL），执行完成后把响应写入同一个 key（带较长的 TTL）
+- 之后的重试：一次 GET 拿到保存的响应直接返回，不再执行（不会重复下单）
+- 第一次请求还在执行时到达的重试：轮询等待它的结果，而不是并发再执行一次
+- 确定没有写入任何数据的失败（校验失败）删除占位，重试会重新执行；
+  其他失败保留占位直到过期（可能已经写入），期间的重试返回 409
+- 同一个 key 被用在内容不同的请求上时拒绝（客户端 bug）
+Redis 不可用时不做幂等控制，请求照常执行（与购物车的 Redis 故障处理一致，优先保证能下单）。
+"""
+import hashlib
+import json
+import time
+from typing import Any, Dict, Optional
+
+import redis
+
+from backend.database import redis_client
+from backend.config import IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_LOCK_SECONDS, IDEMPOTENCY_WAIT_SECONDS
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+# 响应来自保存的结果（重放）时带上这个响应头
+IDEMPOTENT_REPLAY_HEADER = "Idempotent-Replayed"
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+IDEMPOTENCY_POLL_INTERVAL_SECONDS = 0.1
+
+
+class IdempotencyStore:
+    def __init__(
+        self,
+        client: redis.Redis = redis_client,
+        ttl: int = IDEMPOTENCY_TTL_SECONDS,
+        lock_seconds: int = IDEMPOTENCY_LOCK_SECONDS,
+        wait_seconds: float = IDEMPOTENCY_WAIT_SECONDS,
+    ):
+        self.client = client
+        self.ttl = ttl
+        # 占位的 TTL：执行中的进程崩溃时，超过这个时间后重试可以重新执行
+        self.lock_seconds = lock_seconds
+        self.wait_seconds = wait_seconds
+
+    @staticmethod
+    def redis_key(scope: str, key: str) -> str:
+        return f"idempotency:{scope}:{key}"
+
+    @staticmethod
+    def fingerprint(payload: Any) -> str:
+        """请求内容的指纹，用来发现同一个 key 被用在不同的请求上"""
+        raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def begin(self, scope: str, key: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """
+        返回已保存的响应时直接重放；返回 None 表示本请求获得执行权，执行后必须调用 complete 或 release
+        key 已用在内容不同的请求上时抛 ValueError；等待执行中的请求超过 wait_seconds 时抛 TimeoutError
+        """
+        redis_key = self.redis_key(scope, key)
+        pending = json.dumps({"fp": fingerprint, "state": "pending"})
+        deadline = time.monotonic() + self.wait_seconds
+        try:
+            raw = self.client.get(redis_key)
+            while True:
+                if raw is None:
+                    if self.client.set(redis_key, pending, nx=True, ex=self.lock_seconds):
+                        return None
+                    # 被并发的请求抢先占位，读取它的状态
+                    raw = self.client.get(redis_key)
+                    continue
+                record = json.loads(raw)
+                if record["fp"] != fingerprint:
+                    raise ValueError("Idempotency-Key has already been used with a different request")
+                if record["state"] == "done":
+                    return record["response"]
+                if time.monotonic() >= deadline:
+                    raise TimeoutError("A request with this Idempotency-Key is still in progress")
+                time.sleep(IDEMPOTENCY_POLL_INTERVAL_SECONDS)
+                raw = self.client.get(redis_key)
+        except redis.RedisError as e:
+            print(f"幂等 key 读取失败，本次请求不做幂等控制: {e}")
+            return None
+
+    def complete(self, scope: str, key: str, fingerprint: str, response: Dict[str, Any]) -> None:
+        """保存执行结果（JSON 可序列化的响应体），之后的重试直接重放"""
+        record = json.dumps({"fp": fingerprint, "state": "done", "response": response})
+        try:
+            self.client.set(self.redis_key(scope, key), record, ex=self.ttl)
+        except redis.RedisError as e:
+            print(f"幂等 key 保存失败: {e}")
+
+    def release(self, scope: str, key: str) -> None:
+        """确定没有写入任何数据的失败：删除占位，让重试重新执行"""
+        try:
+            self.client.delete(self.redis_key(scope, key))
+        except redis.RedisError as e:
+            print(f"幂等 key 删除失败: {e}")
+
+
+# 创建全局实例
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,131 @@
+"""
+Precompiled menu document
+整份菜单文档（分类 -> 产品 -> 启用的 modifier + 过敏原）：
+- 前端原来要 /catalog/categories + /catalog/products + N 次 /catalog/products/{id}，共 N+2 次请求
+- 现在每个目录版本只编译一次，保存为可直接发送的 bytes，同时预先算好 gzip / brotli 版本
+- 之后每次请求只是把内存里的 bytes 写出去
+"""
+import gzip
+import json
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from backend.utils.catalog_cache import catalog_cache, CatalogSnapshot, ProductRow
+
+try:
+    import brotli
+except ImportError:  # brotli 是可选依赖，没装时只提供 gzip
+    brotli = None
+
+
+@dataclass(frozen=True)
+class MenuDocument:
+    version: int
+    identity: bytes
+    gzip: bytes
+    br: Optional[bytes]
+
+    def body(self, encoding: Optional[str]) -> bytes:
+        if encoding == "br" and self.br is not None:
+            return self.br
+        if encoding == "gzip":
+            return self.gzip
+        return self.identity
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """按 Accept-Encoding 选出最合适的压缩方式：br > gzip > 不压缩(None)"""
+    accepted, rejected = set(), set()
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    # q=0 明确拒绝，"*" 也不能把它加回来
+                    rejected.add(coding)
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding)
+    if "*" in accepted:
+        accepted.update({"br", "gzip"} - rejected)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def _json_default(value: Any):
+    # 与 pydantic 输出保持一致：Decimal 输出为字符串
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _product_entry(snapshot: CatalogSnapshot, product: ProductRow) -> Dict[str, Any]:
+    return {
+        "id": product.id,
+        "name": product.name,
+        "price": product.price,
+        "type_id": product.type_id,
+        "allergens": snapshot.allergens_of(product.id),
+        "modifiers": [
+            {
+                "id": m.id,
+                "name": m.name,
+                "type": m.type,
+                "price": m.price,
+                "is_active": m.is_active,
+            }
+            for m in snapshot.active_modifiers(product.id)
+        ],
+    }
+
+
+def compile_menu_document(snapshot: CatalogSnapshot) -> MenuDocument:
+    category_ids = {c.id for c in snapshot.categories}
+    categories: List[Dict[str, Any]] = [
+        {
+            "id": c.id,
+            "name": c.name,
+            "products": [
+                _product_entry(snapshot, p)
+                for p in snapshot.products_by_category.get(c.id, ())
+            ],
+        }
+        for c in snapshot.categories
+    ]
+    # 分类已被删除但产品还在的情况，单独放一组，避免产品在菜单中消失
+    uncategorized = [
+        _product_entry(snapshot, p)
+        for p in snapshot.products
+        if p.type_id not in category_ids
+    ]
+    document = {
+        "version": snapshot.version,
+        "categories": categories,
+        "uncategorized": uncategorized,
+    }
+    identity = json.dumps(
+        document, default=_json_default, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+    return MenuDocument(
+        version=snapshot.version,
+        identity=identity,
+        gzip=gzip.compress(identity, compresslevel=9),
+        br=brotli.compress(identity) if brotli is not None else None,
+    )
+
+
+def get_menu_document(db: Session) -> MenuDocument:
+    """当前目录版本的菜单文档（每个版本只编译一次）"""
+    snapshot = catalog_cache.get_snapshot(db)
+    return snapshot.memoize("menu_document", compile_menu_document)
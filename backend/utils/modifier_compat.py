@@ -0,0 +1,55 @@
+"""
+Product-modifier compatibility index
+产品与 modifier 的兼容性索引（购物车校验用）：
+- product_id -> 允许选择的 modifier_id 集合（modifier_product 中关联、且 is_active=1）
+- 同一个 modifier 不能重复选；单选类型（尺寸 / 甜度 / 冰度等）同一类型最多只能选一个
+- 随目录快照一起构建，关联或 modifier 状态变化（目录版本号 bump）时整体重建；校验只是集合包含判断，不查库
+"""
+from typing import Dict, FrozenSet, Iterable, List, Mapping
+
+from backend.config import CART_SINGLE_CHOICE_MODIFIER_TYPES
+
+
+class ModifierCompatibility:
+    def __init__(
+        self,
+        product_modifier_ids: Mapping[int, Iterable[int]],
+        modifier_types: Mapping[int, str],
+        active_modifier_ids: FrozenSet[int],
+        single_choice_types: FrozenSet[str] = CART_SINGLE_CHOICE_MODIFIER_TYPES,
+    ):
+        self.single_choice_types = single_choice_types
+        self.modifier_types = modifier_types
+        self.active_modifier_ids = active_modifier_ids
+        # product_id -> 允许的 modifier_id；没有任何可选 modifier 的产品不存（视为空集）
+        self.allowed: Dict[int, FrozenSet[int]] = {}
+        for product_id, modifier_ids in product_modifier_ids.items():
+            allowed = frozenset(modifier_ids) & active_modifier_ids
+            if allowed:
+                self.allowed[product_id] = allowed
+
+    def allowed_for(self, product_id: int) -> FrozenSet[int]:
+        return self.allowed.get(product_id, frozenset())
+
+    def validate(self, product_id: int, modifier_ids: List[int]) -> None:
+        """校验一组 modifier 能否加到该产品上，不能时抛 ValueError"""
+        if not modifier_ids:
+            return
+        selected = set(modifier_ids)
+        # 同一个 modifier 只能选一次（否则会被重复计价）
+        if len(selected) != len(modifier_ids):
+            raise ValueError("Duplicate modifiers are not allowed")
+        if not selected <= self.active_modifier_ids:
+            raise ValueError("Some modifiers are invalid or inactive")
+        if not selected <= self.allowed_for(product_id):
+            raise ValueError("Some modifiers are not available for this product")
+
+        # 单选类型：同一类型只能出现一次
+        seen = set()
+        for modifier_id in modifier_ids:
+            modifier_type = self.modifier_types[modifier_id]
+            if modifier_type not in self.single_choice_types:
+                continue
+            if modifier_type in seen:
+                raise ValueError(f"Only one '{modifier_type}' modifier can be selected")
+            seen.add(modifier_type)
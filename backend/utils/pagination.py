@@ -0,0 +1,55 @@
+"""
+Keyset (cursor) pagination helpers
+游标分页：
+- 游标是不透明的 token，内容为「上一页最后一条记录的排序键」，例如 id 或 (created_at, id)
+- 下一页直接 WHERE 排序键 < / > 游标，任何深度的翻页代价都一样（不像 OFFSET 线性变慢）
+- 下一页游标通过响应头 X-Next-Cursor 返回，保持原有响应体（列表）不变
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(kind: str, *values: Any) -> str:
+    """把排序键编码为游标；kind 用来区分不同列表，防止游标串用"""
+    payload = [kind] + [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str, kind: str) -> List[Any]:
+    """解析游标，返回排序键列表；格式不对或 kind 不匹配时抛 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(payload, list) or not payload or payload[0] != kind:
+        raise ValueError("Invalid cursor")
+    return payload[1:]
+
+
+def decode_id_cursor(token: Optional[str], kind: str) -> Optional[int]:
+    """单个整数 id 的游标（产品列表）"""
+    if not token:
+        return None
+    values = decode_cursor(token, kind)
+    if len(values) != 1 or not isinstance(values[0], int):
+        raise ValueError("Invalid cursor")
+    return values[0]
+
+
+def decode_time_id_cursor(token: Optional[str], kind: str) -> Optional[Tuple[datetime, int]]:
+    """(created_at, id) 的游标（订单列表）"""
+    if not token:
+        return None
+    values = decode_cursor(token, kind)
+    if len(values) != 2 or not isinstance(values[1], int):
+        raise ValueError("Invalid cursor")
+    try:
+        return datetime.fromisoformat(values[0]), values[1]
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
@@ -0,0 +1,168 @@
+"""
+Product name search index
+内存中的产品名前缀索引（kiosk / 收银台菜单搜索）：
+- 归一化：大小写不敏感（casefold）、去重音（"Brûlée" 可以用 "brulee" 搜到）
+- 每个词的所有前缀都指向产品 id，"brown sug" = 两个前缀集合求交集
+- 中文：每个汉字起始的后缀都建前缀，"奶茶" 能搜到 "珍珠奶茶"；
+  装了 pypinyin 时额外索引全拼和首字母（"zhenzhu" / "zznc"）
+- 跟随目录版本：本进程的 create/update/delete 增量更新，其他 worker 的变更触发整体重建
+"""
+import re
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set
+
+from backend.utils.catalog_cache import CatalogSnapshot, ProductRow
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:  # pypinyin 是可选依赖，没装时不提供拼音搜索
+    lazy_pinyin = None
+
+# 单个词最多索引多长的前缀（再长的查询会被截断后再匹配）
+MAX_PREFIX_LENGTH = 24
+
+_WORD_RE = re.compile(r"[^\W_]+")
+_CJK_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
+
+
+def normalize(text: str) -> str:
+    """casefold + 去掉重音符号"""
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return stripped.casefold()
+
+
+def _words(text: str) -> List[str]:
+    return _WORD_RE.findall(normalize(text))
+
+
+def _index_terms(name: str) -> Set[str]:
+    """一个产品名需要索引的所有词（每个词再展开为前缀）"""
+    words = _words(name)
+    terms = set(words)
+    # 整个名字去掉空格也作为一个词：支持 "brownsugar" 这种连写
+    terms.add("".join(words))
+    for word in words:
+        if _CJK_RE.search(word):
+            # 中文没有空格分词：从每个字开始的后缀都当作一个词
+            terms.update(word[i:] for i in range(1, len(word)))
+    if lazy_pinyin is not None and _CJK_RE.search(name):
+        syllables = [s for s in (normalize(p) for p in lazy_pinyin(name)) if s.isalnum()]
+        initials = [
+            s for s in (normalize(p) for p in lazy_pinyin(name, style=Style.FIRST_LETTER))
+            if s.isalnum()
+        ]
+        terms.update(syllables)
+        terms.add("".join(syllables))
+        terms.add("".join(initials))
+    terms.discard("")
+    return terms
+
+
+def _prefixes(terms: Iterable[str]) -> Set[str]:
+    result = set()
+    for term in terms:
+        for i in range(1, min(len(term), MAX_PREFIX_LENGTH) + 1):
+            result.add(term[:i])
+    return result
+
+
+class ProductSearchIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version: Optional[int] = None
+        self._postings: Dict[str, Set[int]] = {}
+        self._keys_by_product: Dict[int, Set[str]] = {}
+        self._products: Dict[int, ProductRow] = {}
+        self._normalized_names: Dict[int, str] = {}
+
+    # ---- 构建 / 增量更新 ----
+
+    def _add(self, product: ProductRow) -> None:
+        keys = _prefixes(_index_terms(product.name))
+        self._keys_by_product[product.id] = keys
+        self._products[product.id] = product
+        self._normalized_names[product.id] = normalize(product.name)
+        for key in keys:
+            self._postings.setdefault(key, set()).add(product.id)
+
+    def _remove(self, product_id: int) -> None:
+        for key in self._keys_by_product.pop(product_id, ()):
+            ids = self._postings.get(key)
+            if ids is not None:
+                ids.discard(product_id)
+                if not ids:
+                    del self._postings[key]
+        self._products.pop(product_id, None)
+        self._normalized_names.pop(product_id, None)
+
+    def ensure(self, snapshot: CatalogSnapshot) -> None:
+        """索引版本与目录快照不一致时，从快照整体重建（不查库）"""
+        if self.version == snapshot.version:
+            return
+        with self._lock:
+            if self.version == snapshot.version:
+                return
+            self._postings = {}
+            self._keys_by_product = {}
+            self._products = {}
+            self._normalized_names = {}
+            for product in snapshot.products:
+                self._add(product)
+            self.version = snapshot.version
+
+    def upsert(self, product: ProductRow, version: int) -> None:
+        """
+        本进程的写操作之后增量更新。
+        只有索引恰好停在上一个版本时才能增量追上；否则（中间还有别人的变更）留给 ensure 整体重建。
+        """
+        with self._lock:
+            if self.version != version - 1:
+                return
+            self._remove(product.id)
+            self._add(product)
+            self.version = version
+
+    def remove(self, product_id: int, version: int) -> None:
+        with self._lock:
+            if self.version != version - 1:
+                return
+            self._remove(product_id)
+            self.version = version
+
+    # ---- 查询 ----
+
+    def search(self, query: str, limit: int = 20) -> List[ProductRow]:
+        words = [w[:MAX_PREFIX_LENGTH] for w in _words(query)]
+        if not words:
+            return []
+        compact = "".join(words)[:MAX_PREFIX_LENGTH]
+
+        with self._lock:
+            # 每个词都要命中某个前缀（求交集），或者整串连写命中
+            matched: Optional[Set[int]] = None
+            for word in sorted(words, key=lambda w: len(self._postings.get(w, ()))):
+                ids = self._postings.get(word)
+                if not ids:
+                    matched = set()
+                    break
+                matched = set(ids) if matched is None else matched & ids
+                if not matched:
+                    break
+            matched = (matched or set()) | self._postings.get(compact, set())
+            # 名字以查询开头的排在前面，其余按名称、id 排序
+            head = normalize(query).strip()
+            ranked = sorted(
+                matched,
+                key=lambda pid: (
+                    not self._normalized_names[pid].startswith(head),
+                    self._normalized_names[pid],
+                    pid,
+                ),
+            )
+            return [self._products[pid] for pid in ranked[:limit]]
+
+
+# 创建全局实例
+product_search_index = ProductSearchIndex()
@@ -1,8 +1,22 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from backend.routers import auth, protected, staff_router, test, user_router, rbac_router, admin_catalog_router, catalog_router, order_router
+from backend.utils.catalog_cache import catalog_listener
+from backend.utils.cart_store import cart_store
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 订阅目录失效通知（多 worker 之间同步商品目录缓存）
+    catalog_listener.start()
+    # 购物车存储的启动准备（Redis 实现会预加载 Lua 脚本、启动故障切换/写回的后台线程）
+    cart_store.warm_up()
+    yield
+    cart_store.shutdown()
+    catalog_listener.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(staff_router.router)
 app.include_router(user_router.router)
 app.include_router(protected.router)
@@ -10,4 +24,4 @@ app.include_router(test.router)
 app.include_router(rbac_router.router)
 app.include_router(admin_catalog_router.router)
 app.include_router(catalog_router.router)
-app.include_router(order_router.router)
\ No newline at end of file
+app.include_router(order_router.router)
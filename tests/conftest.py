@@ -0,0 +1,104 @@
+"""
+测试公共 fixture：SQLite 内存库代替 MySQL，fakeredis 代替 Redis
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeredis
+import pytest
+from sqlalchemy import BigInteger, create_engine, event, text
+from sqlalchemy.dialects.mysql import TINYINT
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from backend.database import Base
+import backend.models.user  # noqa: F401  注册所有表
+import backend.models.catalog  # noqa: F401
+import backend.models.order  # noqa: F401
+import backend.models.staff  # noqa: F401
+import backend.models.role  # noqa: F401
+
+
+@compiles(BigInteger, "sqlite")
+@compiles(TINYINT, "sqlite")
+def _sqlite_integer(element, compiler, **kw):
+    # SQLite 只有 INTEGER PRIMARY KEY 才会自增
+    return "INTEGER"
+
+
+# SQLite 不支持 ON UPDATE CURRENT_TIMESTAMP，测试中换成普通默认值
+for _table in Base.metadata.tables.values():
+    for _column in _table.columns:
+        default = _column.server_default
+        if default is not None and "ON UPDATE" in str(getattr(default, "arg", "")):
+            default.arg = text("CURRENT_TIMESTAMP")
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine):
+    return sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+
+@pytest.fixture
+def fake_redis():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+@pytest.fixture
+def statements(engine):
+    """执行过的 SQL 语句（测试中 clear() 后再统计）"""
+    executed = []
+
+    def record(conn, cursor, statement, *args):
+        executed.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(engine, "before_cursor_execute", record)
+
+
+@pytest.fixture
+def catalog(session_factory):
+    """最小目录：3 个产品、3 个 modifier，产品 1 可以加所有 modifier"""
+    from decimal import Decimal
+    from backend.models.catalog import Modifier, ModifierProduct, Product, ProductType
+
+    with session_factory() as db:
+        db.add_all([ProductType(id=1, name="Tea"), ProductType(id=2, name="Cake")])
+        db.add_all([
+            Product(id=1, name="Brown Sugar Milk Tea", price=Decimal("5.50"), type_id=1),
+            Product(id=2, name="Taro Latte", price=Decimal("6.00"), type_id=1),
+            Product(id=3, name="Creme Brulee Cake", price=Decimal("7.25"), type_id=2),
+        ])
+        db.add_all([
+            Modifier(id=1, name="Large", type="size", price=Decimal("1.00"), is_active=1),
+            Modifier(id=2, name="Medium", type="size", price=Decimal("0.50"), is_active=1),
+            Modifier(id=3, name="Pearl", type="addon", price=Decimal("0.75"), is_active=1),
+        ])
+        db.add_all([ModifierProduct(product_id=1, modifier_id=m) for m in (1, 2, 3)])
+        db.commit()
+
+
+@pytest.fixture
+def order_env(monkeypatch, fake_redis, session_factory, catalog):
+    """order_crud 使用 fakeredis 上的购物车和独立的目录缓存"""
+    from backend.crud import order_crud
+    from backend.utils.cart_scripts import CartScripts
+    from backend.utils.cart_store import RedisCartStore
+    from backend.utils.catalog_cache import CatalogCache
+
+    cache = CatalogCache(fake_redis, session_factory)
+    monkeypatch.setattr(order_crud, "catalog_cache", cache)
+    monkeypatch.setattr(order_crud, "cart_store", RedisCartStore(fake_redis, CartScripts(fake_redis)))
+    return cache
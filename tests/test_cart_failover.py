@@ -0,0 +1,138 @@
+"""
+Redis 故障切换到 SQL、恢复后合并回 Redis
+"""
+import pytest
+import redis
+
+from backend.utils.cart_scripts import CartScripts
+from backend.utils.cart_store import FailoverCartStore, RedisCartStore, SQLCartStore
+from tests.test_cart_store import USER_ID, VERSION, make_line
+
+
+@pytest.fixture
+def failover(fake_redis, session_factory):
+    # 后台线程的间隔设得很长，测试中直接调用恢复逻辑
+    store = FailoverCartStore(
+        RedisCartStore(fake_redis, CartScripts(fake_redis)), SQLCartStore(session_factory),
+        retry_seconds=60, write_behind_seconds=0,
+    )
+    yield store
+    store.shutdown()
+
+
+@pytest.fixture
+def outage(monkeypatch, fake_redis):
+    def down(*args, **kwargs):
+        raise redis.ConnectionError("Error 111 connecting to localhost:6379. Connection refused.")
+
+    pool = fake_redis.connection_pool
+    original = pool.get_connection
+
+    class Outage:
+        def start(self):
+            monkeypatch.setattr(pool, "get_connection", down)
+
+        def end(self):
+            monkeypatch.setattr(pool, "get_connection", original)
+
+    return Outage()
+
+
+def contents(store):
+    return sorted((line["product_id"], line["quantity"]) for line in store.load(USER_ID).lines.values())
+
+
+def test_recovery_merges_outage_writes_into_existing_cart(failover, outage):
+    failover.add_line(USER_ID, make_line(1, 3), VERSION, True)
+    failover.add_line(USER_ID, make_line(3, 1), VERSION, True)
+
+    outage.start()
+    failover.add_line(USER_ID, make_line(2, 1), VERSION, True)
+    failover.add_line(USER_ID, make_line(3, 1), VERSION, True)
+    assert not failover.available
+    outage.end()
+
+    failover._try_recover()
+
+    assert failover.available
+    # Redis 中故障前的行保留，故障期间的行合并进来（相同配置累加数量）
+    assert contents(failover) == [(1, 3), (2, 1), (3, 2)]
+    assert failover.fallback.non_empty_carts() == {}
+
+
+def test_write_that_timed_out_after_sending_is_not_replayed_on_sql(failover, monkeypatch):
+    add_line = failover.primary.add_line
+
+    def sent_then_timed_out(*args):
+        add_line(*args)
+        raise redis.TimeoutError("Timeout reading from socket")
+
+    monkeypatch.setattr(failover.primary, "add_line", sent_then_timed_out)
+    with pytest.raises(redis.TimeoutError):
+        failover.add_line(USER_ID, make_line(1, 2), VERSION, True)
+    monkeypatch.undo()
+
+    # 切换到 SQL，但这次写入没有在 SQL 上再做一次
+    assert not failover.available
+    assert failover.fallback.non_empty_carts() == {}
+
+    failover._try_recover()
+    assert contents(failover) == [(1, 2)]
+
+
+def test_lines_written_to_sql_by_other_workers_are_drained(failover):
+    failover.add_line(USER_ID, make_line(1, 1), VERSION, True)
+    # 另一个 worker 故障切换期间写进 SQL 的行
+    failover.fallback.add_line(USER_ID, make_line(2, 2), VERSION, True)
+
+    failover._reconcile()
+
+    assert contents(failover) == [(1, 1), (2, 2)]
+    assert failover.fallback.non_empty_carts() == {}
+
+
+@pytest.fixture
+def write_behind(fake_redis, session_factory):
+    # 写回在测试中手动调用 flush
+    store = FailoverCartStore(
+        RedisCartStore(fake_redis, CartScripts(fake_redis)), SQLCartStore(session_factory),
+        retry_seconds=60, write_behind_seconds=60,
+    )
+    yield store
+    store.shutdown()
+
+
+def test_clear_during_outage_survives_recovery(write_behind, outage):
+    write_behind.add_line(USER_ID, make_line(1, 2), VERSION, True)
+    write_behind.flush()
+
+    outage.start()
+    # 下单成功后清空购物车
+    write_behind.clear(USER_ID)
+    outage.end()
+
+    write_behind._try_recover()
+    write_behind.flush()
+
+    assert contents(write_behind) == []
+    assert write_behind.fallback.non_empty_carts() == {}
+
+
+def test_removals_and_quantity_cuts_during_outage_survive_recovery(write_behind, outage):
+    first = write_behind.add_line(USER_ID, make_line(1, 2), VERSION, True)
+    write_behind.add_line(USER_ID, make_line(2, 5), VERSION, True)
+    write_behind.flush()
+
+    outage.start()
+    lines = {line["product_id"]: line for line in write_behind.load(USER_ID).lines.values()}
+    assert write_behind.remove_line(USER_ID, lines[1]["id"])
+    write_behind.update_line(USER_ID, lines[2]["id"], 1, None, [], 0, VERSION)
+    outage.end()
+
+    write_behind._try_recover()
+    write_behind.flush()
+
+    assert contents(write_behind) == [(2, 1)]
+    assert first["id"] not in write_behind.primary.load(USER_ID).lines
+    assert sorted((line["product_id"], line["quantity"])
+                  for line in write_behind.fallback.load(USER_ID).lines.values()) == [(2, 1)]
@@ -0,0 +1,41 @@
+"""
+购物车读取的查询次数与购物车大小无关
+"""
+import pytest
+
+from backend.crud import order_crud
+
+
+def fill_cart(session_factory, user_id, lines):
+    with session_factory() as db:
+        for i in range(lines):
+            # 不合并：每次添加都是独立的一行
+            order_crud.add_to_cart(db, user_id, 1 + i % 3, 1, [], merge=False)
+
+
+def count_cart_read(session_factory, statements, user_id):
+    with session_factory() as db:
+        statements.clear()
+        items, _, _ = order_crud.get_cart_with_totals(db, user_id)
+        return len(items), len(statements)
+
+
+@pytest.mark.parametrize("stale", [False, True], ids=["current", "after-catalog-change"])
+def test_cart_read_query_count_is_constant(order_env, session_factory, statements, stale):
+    fill_cart(session_factory, 1, 1)
+    fill_cart(session_factory, 2, 10)
+    if stale:
+        # 目录变更后第一次读取要重新定价：只重建一次快照，与行数无关
+        order_env.invalidate()
+
+    small = count_cart_read(session_factory, statements, 1)
+    if stale:
+        # 快照已经在上一次读取中重建，大购物车的重新定价同样不查库
+        order_env.invalidate()
+    large = count_cart_read(session_factory, statements, 2)
+
+    assert small[0] == 1 and large[0] == 10
+    assert small[1] == large[1]
+    if not stale:
+        # 目录版本没变：完全从 Redis 渲染
+        assert large[1] == 0
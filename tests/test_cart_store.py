@@ -0,0 +1,152 @@
+"""
+CartStore 一致性测试：同一组用例分别跑 Redis（fakeredis + Lua 脚本）、进程内和 SQL 三种实现
+"""
+import itertools
+
+import pytest
+
+from backend.utils.cart_scripts import CartScripts
+from backend.utils.cart_store import MemoryCartStore, RedisCartStore, SQLCartStore
+
+USER_ID = 7
+VERSION = "1"
+_ids = itertools.count(1)
+
+
+@pytest.fixture(params=["redis", "memory", "sql"])
+def store(request, fake_redis, session_factory):
+    if request.param == "redis":
+        return RedisCartStore(fake_redis, CartScripts(fake_redis))
+    if request.param == "memory":
+        return MemoryCartStore()
+    return SQLCartStore(session_factory)
+
+
+def make_line(product_id, quantity=1, modifiers=(), unit_cents=550, version=VERSION):
+    """带价格快照的新行（order_crud.add_to_cart 写入的格式）"""
+    return {
+        "id": f"line_{next(_ids)}",
+        "product_id": product_id,
+        "quantity": quantity,
+        "modifiers": list(modifiers),
+        "created_at": f"2026-01-01T00:00:{next(_ids) % 60:02d}",
+        "v": version,
+        "name": f"Product {product_id}",
+        "price": "5.50",
+        "mods": [],
+        "base_cents": unit_cents,
+        "unit_cents": unit_cents,
+        "subtotal_cents": unit_cents * quantity,
+    }
+
+
+def contents(store):
+    """购物车中的 (product_id, quantity, 排序后的 modifiers)，按加入顺序"""
+    return [
+        (line["product_id"], line["quantity"], sorted(line["modifiers"]))
+        for line in store.load(USER_ID).lines.values()
+    ]
+
+
+def assert_totals(store, subtotal_cents, count):
+    # SQL 实现不维护总价（返回 None），由 order_crud 读取时重新汇总
+    totals = store.totals(USER_ID)
+    if totals is not None:
+        assert (totals.subtotal_cents, totals.count) == (subtotal_cents, count)
+
+
+def test_add_and_load(store):
+    added = store.add_line(USER_ID, make_line(1, 2, [3]), VERSION, True)
+
+    assert added["product_id"] == 1 and added["quantity"] == 2
+    assert contents(store) == [(1, 2, [3])]
+    assert store.get_product_id(USER_ID, added["id"]) == 1
+    assert_totals(store, 1100, 2)
+
+
+def test_add_merges_same_configuration(store):
+    first = store.add_line(USER_ID, make_line(1, 2, [3, 1]), VERSION, True)
+    merged = store.add_line(USER_ID, make_line(1, 1, [1, 3]), VERSION, True)
+
+    assert merged["id"] == first["id"]
+    assert merged["quantity"] == 3
+    assert contents(store) == [(1, 3, [1, 3])]
+    assert_totals(store, 1650, 3)
+
+
+def test_add_without_merge_creates_new_line(store):
+    store.add_line(USER_ID, make_line(1), VERSION, True)
+    store.add_line(USER_ID, make_line(1), VERSION, False)
+    store.add_line(USER_ID, make_line(2), VERSION, True)
+
+    assert contents(store) == [(1, 1, []), (1, 1, []), (2, 1, [])]
+    assert_totals(store, 1650, 3)
+
+
+def test_update_quantity_and_modifiers(store):
+    line = store.add_line(USER_ID, make_line(1, 1), VERSION, True)
+
+    updated = store.update_line(USER_ID, line["id"], 4, None, [], 0, VERSION)
+    assert updated["quantity"] == 4
+    assert_totals(store, 2200, 4)
+
+    updated = store.update_line(USER_ID, line["id"], None, [2], [[2, "Medium", "size", "0.50"]], 50, VERSION)
+    assert updated["modifiers"] == [2]
+    assert contents(store) == [(1, 4, [2])]
+    assert_totals(store, 2400, 4)
+
+
+def test_update_missing_line(store):
+    store.add_line(USER_ID, make_line(1), VERSION, True)
+    assert store.update_line(USER_ID, "999999", 2, None, [], 0, VERSION) is None
+    assert store.update_line(USER_ID + 1, "999999", 2, None, [], 0, VERSION) is None
+
+
+def test_remove_line(store):
+    kept = store.add_line(USER_ID, make_line(1), VERSION, True)
+    removed = store.add_line(USER_ID, make_line(2, 2), VERSION, True)
+
+    assert store.remove_line(USER_ID, removed["id"]) is True
+    assert store.remove_line(USER_ID, removed["id"]) is False
+    assert store.remove_line(USER_ID + 1, kept["id"]) is False
+    assert contents(store) == [(1, 1, [])]
+    assert_totals(store, 550, 1)
+
+
+def test_reprice_writes_lines_and_drops(store):
+    kept = store.add_line(USER_ID, make_line(1, 2), VERSION, True)
+    dropped = store.add_line(USER_ID, make_line(2), VERSION, True)
+
+    state = store.load(USER_ID)
+    repriced = dict(state.lines[kept["id"]], v="2", base_cents=600, unit_cents=600, subtotal_cents=1200)
+    result = store.reprice(USER_ID, state, "2", {kept["id"]: repriced}, [dropped["id"]])
+
+    assert result == (1200, 2)
+    assert contents(store) == [(1, 2, [])]
+    totals = store.totals(USER_ID)
+    if totals is not None:
+        assert (totals.subtotal_cents, totals.count, totals.version) == (1200, 2, "2")
+
+
+def test_clear(store):
+    store.add_line(USER_ID, make_line(1), VERSION, True)
+    store.add_line(USER_ID + 1, make_line(2), VERSION, True)
+
+    store.clear(USER_ID)
+
+    assert contents(store) == []
+    assert len(store.load(USER_ID + 1).lines) == 1
+    # 清空后再添加，相同配置不会合并到已删除的行
+    store.add_line(USER_ID, make_line(1), VERSION, True)
+    assert contents(store) == [(1, 1, [])]
+
+
+def test_replace(store):
+    store.add_line(USER_ID, make_line(1), VERSION, True)
+
+    store.replace(USER_ID, [make_line(2, 2, [1]), make_line(3)])
+
+    assert contents(store) == [(2, 2, [1]), (3, 1, [])]
+    # 替换后的行参与合并
+    store.add_line(USER_ID, make_line(2, 1, [1]), VERSION, True)
+    assert contents(store) == [(2, 3, [1]), (3, 1, [])]
@@ -0,0 +1,93 @@
+import time
+from decimal import Decimal
+
+import redis
+
+from backend.models.catalog import Product, ProductType
+from backend.utils.catalog_cache import (
+    CATALOG_CHANNEL, CATALOG_VERSION_KEY, CatalogCache, CatalogInvalidationListener
+)
+
+
+def test_observe_version_never_goes_backwards(fake_redis, session_factory):
+    cache = CatalogCache(fake_redis, session_factory)
+
+    assert cache.observe_version(10) is True
+    assert cache.observe_version(9) is False
+    assert cache.observe_version(10) is False
+    assert cache.version == 10
+
+
+def test_snapshot_is_rebuilt_in_its_own_session(fake_redis, session_factory):
+    cache = CatalogCache(fake_redis, session_factory)
+    with session_factory() as db:
+        db.add_all([ProductType(id=1, name="Tea"), Product(id=1, name="Milk Tea", price=Decimal("5.50"), type_id=1)])
+        db.commit()
+
+    # 不传调用方的会话也能重建
+    assert cache.get_snapshot().products_by_id[1].price == Decimal("5.50")
+
+    with session_factory() as db:
+        db.get(Product, 1).price = Decimal("6.00")
+        db.commit()
+        cache.invalidate(db)
+    assert cache.get_snapshot().products_by_id[1].price == Decimal("6.00")
+
+
+def test_local_bump_is_republished_and_never_shadows_redis_versions(fake_redis, session_factory, monkeypatch):
+    worker_a = CatalogCache(fake_redis, session_factory)
+    worker_b = CatalogCache(fake_redis, session_factory)
+    fake_redis.set(CATALOG_VERSION_KEY, 100)
+    worker_a.sync_version()
+    worker_b.sync_version()
+
+    pool = fake_redis.connection_pool
+    original = pool.get_connection
+
+    def down(*args, **kwargs):
+        raise redis.ConnectionError("Error 111 connecting to localhost:6379. Connection refused.")
+
+    # worker A 写目录时 Redis 不可用：只在本地 bump
+    monkeypatch.setattr(pool, "get_connection", down)
+    local_version = worker_a.invalidate()
+    worker_a.sync_version()
+    monkeypatch.setattr(pool, "get_connection", original)
+
+    # 随后 worker B 的变更拿到 Redis 中的下一个版本号：A 也必须重建，两边的 ETag 不能相同
+    assert worker_b.invalidate() == 101
+    assert local_version != 101
+    assert worker_a.observe_version(101) is True
+    assert worker_a.version == 101
+
+    # Redis 可用后补发 A 那次变更
+    pubsub = fake_redis.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(CATALOG_CHANNEL)
+    worker_a.sync_version()
+    assert int(fake_redis.get(CATALOG_VERSION_KEY)) == 102
+    assert worker_a.version == 102
+    # 第一次 get_message 消费的是订阅确认
+    messages = [pubsub.get_message(timeout=0.1) for _ in range(2)]
+    assert [m["data"] for m in messages if m] == ["102"]
+
+    worker_a.sync_version()
+    assert int(fake_redis.get(CATALOG_VERSION_KEY)) == 102
+
+
+def test_listener_polls_the_version_while_subscribed(fake_redis, session_factory):
+    cache = CatalogCache(fake_redis, session_factory)
+    fake_redis.set(CATALOG_VERSION_KEY, 100)
+    listener = CatalogInvalidationListener(cache, fake_redis, poll_interval=0.05)
+    listener.start()
+    try:
+        # 等监听线程订阅并完成订阅后的那次同步
+        while not fake_redis.pubsub_numsub(CATALOG_CHANNEL)[0][1]:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        # 订阅收不到消息（例如半开连接）时，版本号只能靠轮询发现
+        fake_redis.incr(CATALOG_VERSION_KEY)
+        deadline = time.monotonic() + 2
+        while cache.version != 101 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert cache.version == 101
+    finally:
+        listener.stop()
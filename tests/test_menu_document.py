@@ -0,0 +1,20 @@
+import pytest
+
+from backend.utils import menu_document
+from backend.utils.menu_document import negotiate_encoding
+
+BR = "br" if menu_document.brotli is not None else "gzip"
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("gzip", "gzip"),
+    ("gzip, br", BR),
+    ("br;q=0, gzip", "gzip"),
+    ("*", BR),
+    ("br;q=0, *", "gzip"),
+    ("br;q=0, gzip;q=0, *", None),
+    ("gzip;q=0", None),
+])
+def test_negotiate_encoding(header, expected):
+    assert negotiate_encoding(header) == expected
@@ -0,0 +1,34 @@
+import pytest
+
+from backend.utils.modifier_compat import ModifierCompatibility
+
+
+@pytest.fixture
+def compat():
+    return ModifierCompatibility(
+        {1: [1, 2, 3]},
+        {1: "size", 2: "size", 3: "addon"},
+        frozenset({1, 2, 3}),
+        single_choice_types=frozenset({"size"}),
+    )
+
+
+def test_valid_selection(compat):
+    compat.validate(1, [1, 3])
+    compat.validate(1, [])
+
+
+@pytest.mark.parametrize("modifier_ids, message", [
+    ([3, 3], "Duplicate modifiers are not allowed"),
+    ([1, 1], "Duplicate modifiers are not allowed"),
+    ([4], "Some modifiers are invalid or inactive"),
+    ([1, 2], "Only one 'size' modifier can be selected"),
+])
+def test_invalid_selection(compat, modifier_ids, message):
+    with pytest.raises(ValueError, match=message):
+        compat.validate(1, modifier_ids)
+
+
+def test_modifier_not_linked_to_product(compat):
+    with pytest.raises(ValueError, match="not available for this product"):
+        compat.validate(2, [3])
@@ -0,0 +1,63 @@
+"""
+订单列表的查询次数与订单数量无关
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.models.order import Order, OrderItem
+from backend.routers import order_router
+
+USER_ID = 7
+
+
+@pytest.fixture
+def client(session_factory, catalog):
+    app = FastAPI()
+    app.include_router(order_router.router)
+
+    def get_db():
+        with session_factory() as db:
+            yield db
+
+    app.dependency_overrides[order_router.get_db] = get_db
+    app.dependency_overrides[order_router.get_current_user_id] = lambda: USER_ID
+    return TestClient(app)
+
+
+def add_orders(session_factory, count):
+    start = datetime(2026, 1, 1)
+    with session_factory() as db:
+        for i in range(count):
+            order = Order(
+                order_number=f"ORD{i:04d}", user_id=USER_ID, payment_method="cash", dine_option="take_out",
+                total_price=Decimal("13.00"), order_status="IP", created_at=start + timedelta(minutes=i),
+            )
+            db.add(order)
+            db.flush()
+            db.add_all([
+                OrderItem(order_id=order.id, product_id=1, quantity=2, price=Decimal("13.00"), modifiers=[
+                    {"modifier_id": 1, "modifier_name": "Large", "modifier_type": "size", "modifier_price": "1.00"}
+                ]),
+                OrderItem(order_id=order.id, product_id=3, quantity=1, price=Decimal("7.25")),
+            ])
+        db.commit()
+
+
+@pytest.mark.parametrize("orders", [1, 20])
+def test_order_list_runs_three_queries(client, session_factory, statements, orders):
+    add_orders(session_factory, orders)
+    statements.clear()
+
+    response = client.get("/order/orders")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert len(body) == orders
+    assert [item["product_name"] for item in body[0]["items"]] == ["Brown Sugar Milk Tea", "Creme Brulee Cake"]
+    # 订单、订单项、产品名称各一次
+    assert len(statements) == 3
+